@@ -0,0 +1,31 @@
+from datetime import datetime
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from services.dataset import PricesCache
+
+router = APIRouter(tags=["health"])
+
+
+@router.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readyz(request: Request):
+    """Ready once the prices cache serves a snapshot; a running background update doesn't block it."""
+    update = getattr(request.app.state, "update_task", None)
+    updating = update is not None and not update.done()
+    if not PricesCache.loaded():
+        return JSONResponse(status_code=503, content={"ready": False, "updating": updating})
+
+    snapshot = PricesCache.snapshot()
+    last_date = snapshot.last_date()
+    return {
+        "ready": True,
+        "data_version": snapshot.version,
+        "last_price_date": last_date.date().isoformat() if last_date is not None else None,
+        "prices_age_days": (datetime.now() - last_date).days if last_date is not None else None,
+        "updating": updating,
+    }
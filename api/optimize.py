@@ -9,7 +9,8 @@ from services.dataset import PricesCache
 from services.registry import ModelRegistry
 from services.stats import compute_stats
 from services.finviz import get_ticker_info
-from services.optimization import select_tickers, optimize_portfolio, normalize_weights
+from services.optimization import optimize_portfolio, normalize_weights
+from services.predictions import PredictionCache
 
 
 class OptimizeRequest(BaseModel):
@@ -28,24 +29,21 @@ router = APIRouter()
 
 @router.post("/optimize", response_model=OptimizeResponse)
 async def optimize(req: OptimizeRequest):
-    picker = ModelRegistry.get_picker(req.model)
-    if picker is None:
+    if ModelRegistry.file_key(req.model) is None:
         raise HTTPException(status_code=404, detail="Unknown model")
 
     risk_fn = ModelRegistry.get_risk_fn(req.risk_model)
     if risk_fn is None:
         raise HTTPException(status_code=404, detail="Unknown risk model")
 
-    dataset, prices = PricesCache.get_dataset(), PricesCache.get_prices()
+    snapshot = PricesCache.snapshot()
     cutoff = pd.to_datetime(req.end_date)
-    dataset = dataset[dataset["date"] <= cutoff]
-    prices = prices[prices["date"]  <= cutoff]
 
     def opt():
-        selected = select_tickers(dataset, picker)
+        selected = PredictionCache.select(req.model, snapshot, cutoff)
         if not selected:
             raise HTTPException(status_code=422, detail="No tickers selected by model")
-        weights, ptf = optimize_portfolio(prices, selected, risk_fn)
+        weights, ptf = optimize_portfolio(snapshot.matrix(selected, end=cutoff), risk_fn)
         return weights, ptf
 
     weights, ptf = await run_in_threadpool(opt)
@@ -1,8 +1,65 @@
-from fastapi import APIRouter
+from datetime import date
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+import pandas as pd
+
+from config import settings
+from services.dataset import PricesCache
+from services.optimization import SELECT_THRESHOLD
+from services.predictions import PredictionCache, ScoringError
 from services.registry import ModelRegistry
 
+
+class ScoreRequest(BaseModel):
+    models: list[str]
+    end_date: date
+
+class ModelScores(BaseModel):
+    probabilities: dict[str, float]
+    selected: list[str]
+
 router = APIRouter()
 
 @router.get("/pickers")
 def list_pickers():
     return ModelRegistry.list_pickers()
+
+@router.get("/pickers/cache")
+def picker_cache():
+    return ModelRegistry.cache_stats()
+
+@router.get("/pickers/metrics")
+def picker_metrics(name: str = None):
+    metrics = ModelRegistry.metrics(name)
+    if metrics is None:
+        raise HTTPException(status_code=404, detail="No training metrics")
+    return metrics
+
+@router.post("/score", response_model=dict[str, ModelScores])
+async def score(req: ScoreRequest):
+    """Latest-quarter probability per ticker and the /optimize selection, for several pickers at once."""
+    if not req.models:
+        raise HTTPException(status_code=422, detail="No models given")
+    available = set(ModelRegistry.list_pickers())
+    unknown = [name for name in req.models if name not in available]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown model(s): {', '.join(unknown)}")
+
+    def run():
+        try:
+            return PredictionCache.latest_scores(
+                list(dict.fromkeys(req.models)), PricesCache.snapshot(), pd.to_datetime(req.end_date),
+                workers=settings.SCORE_WORKERS,
+            )
+        except ScoringError as e:
+            raise HTTPException(status_code=422, detail=f"Scoring model {e.name} failed: {e.__cause__}")
+
+    scores = await run_in_threadpool(run)
+    return {
+        name: ModelScores(
+            probabilities=avg_pred.to_dict(),
+            selected=avg_pred.index[avg_pred > SELECT_THRESHOLD].tolist(),
+        )
+        for name, avg_pred in scores.items()
+    }
@@ -125,20 +125,15 @@ async def rebalance_portfolio(
     capital = body.capital if body.capital else doc["capital"]
     as_of = pd.to_datetime(body.as_of) if body.as_of else datetime.now()
 
-    prices = PricesCache.get_prices()
-    prices = prices[(prices['ticker'].isin(selected)) & (prices["date"] <= as_of)]
+    price_matrix = PricesCache.matrix(selected, end=as_of)
 
     risk_fn = ModelRegistry.get_risk_fn(body.risk_model)
     if not risk_fn:
         raise HTTPException(status_code=404, detail="Unknown risk model")
 
-    weights, ptf = optimize_portfolio(prices, selected, risk_fn)
+    weights, ptf = optimize_portfolio(price_matrix, risk_fn)
 
-    last_prices = (
-        prices.sort_values(["ticker","date"])
-        .groupby("ticker").tail(1)
-        .set_index("ticker")['price']
-    )
+    last_prices = price_matrix.ffill().iloc[-1].dropna()
     stocks = normalize_weights(weights, last_prices, capital)
     total_capital = sum(s['allocated'] for s in stocks)
 
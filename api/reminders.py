@@ -4,6 +4,7 @@ from pydantic import BaseModel, Field
 from typing import List
 from datetime import datetime
 
+from config import settings
 from services.reminders import (
     get_reminders_for_portfolio,
     toggle_reminder,
@@ -17,7 +18,9 @@ router = APIRouter(
 
 @router.on_event("startup")
 async def startup_event():
-    init_scheduler()
+    # with several workers the parent process runs the scheduler (main.py)
+    if settings.RUN_SCHEDULER:
+        init_scheduler()
 
 class Reminder(BaseModel):
     id: str = Field(alias="_id")
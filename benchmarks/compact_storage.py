@@ -0,0 +1,105 @@
+"""
+Validate the compact PricesCache storage against the full float64 layout
+and report the memory footprint of both, for the DB's dataset table as it is
+and as rewritten by rebuild_dataset (on a copy of the DB).
+
+    python -m benchmarks.compact_storage [end_date]
+"""
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import numpy as np
+import pandas as pd
+
+from config import settings
+from services import updater
+from services.dataset import _read_sqlite
+from services.registry import ModelRegistry
+from services.optimization import select_tickers
+
+RTOL = 1e-6  # float32 has ~7 significant digits
+PROBA_ATOL = 1e-4
+
+
+def _load(db: str, storage: str):
+    settings.PRICES_STORAGE = storage
+    con = sqlite3.connect(db)
+    snapshot = _read_sqlite(con)
+    con.close()
+    return snapshot
+
+
+def check(db: str, end_date: str = None):
+    full, compact = _load(db, "full"), _load(db, "compact")
+    print(f"full:    {full.nbytes() / 1024 ** 2:8.1f} MB")
+    print(f"compact: {compact.nbytes() / 1024 ** 2:8.1f} MB")
+
+    # features; compact stores a missing `_na` flag (no fundamentals yet) as 1
+    f_ds, c_ds = full.dataset(), compact.dataset()
+    num_cols = [c for c in f_ds.columns if c not in ("ticker", "date")]
+    na_cols = [c for c in num_cols if c.endswith("_na")]
+    print(f"rows without `_na` flags: {f_ds[na_cols].isna().any(axis=1).sum()} of {len(f_ds)}")
+    a = f_ds[num_cols].fillna({c: 1 for c in na_cols}).to_numpy(dtype=np.float64)
+    b = c_ds[num_cols].to_numpy(dtype=np.float64)
+    assert np.array_equal(np.isnan(a), np.isnan(b)), "NaN layout differs"
+    scale = np.maximum(np.abs(a), 1.0)
+    err = np.nanmax(np.abs(a - b) / scale)
+    print(f"dataset max rel error: {err:.2e}")
+    assert err < RTOL
+    assert (f_ds["ticker"].to_numpy() == c_ds["ticker"].astype(str).to_numpy()).all()
+
+    # prices
+    tickers = list(full._columns)
+    f_px, c_px = full.matrix(tickers, end=end_date), compact.matrix(tickers, end=end_date)
+    err = np.nanmax(np.abs(f_px.to_numpy() - c_px.to_numpy()) / np.abs(f_px.to_numpy()))
+    print(f"prices max rel error:  {err:.2e}")
+    assert err < RTOL
+
+    # picker outputs, on the rows pickers can score (no missing features)
+    end = pd.Timestamp(end_date) if end_date else f_ds["date"].max()
+    ModelRegistry.scan(settings.ML_PICKERS_DIR)
+    f_until, c_until = full.dataset_until(end), compact.dataset_until(end)
+    complete = f_until.notna().all(axis=1).to_numpy()
+    f_until, c_until = f_until[complete], c_until[complete]
+    exclude = {"ticker", "date", "quarter_id", "close_raw", "outperformed"}
+    feature_cols = [c for c in f_until.columns if c not in exclude]
+    for name in ModelRegistry.list_pickers():
+        picker = ModelRegistry.get_picker(name)
+        if not hasattr(picker, "predict_proba"):
+            continue
+        if getattr(picker, "n_features_in_", len(feature_cols)) != len(feature_cols):
+            print(f"{name:>10}: trained on {picker.n_features_in_} features, dataset has {len(feature_cols)}; skipped")
+            continue
+        p_full = picker.predict_proba(f_until[feature_cols].to_numpy())[:, 1]
+        p_compact = picker.predict_proba(c_until[feature_cols].to_numpy())[:, 1]
+        diff = np.abs(p_full - p_compact).max()
+        same = select_tickers(f_until, picker) == select_tickers(c_until, picker)
+        print(f"{name:>10}: max |dp| {diff:.2e}, same selection: {same}")
+        assert diff < PROBA_ATOL
+
+
+def main(end_date: str = None):
+    src = settings.DB_PATH
+    print(f"dataset table of {src}")
+    check(src, end_date)
+
+    tmp = tempfile.mkdtemp()
+    db = os.path.join(tmp, "rebuilt.db")
+    shutil.copy(src, db)
+    settings.SNAPSHOT_DIR = os.path.join(tmp, "snapshot")
+    settings.FEATURE_STORE_DIR = os.path.join(tmp, "features")
+    try:
+        updater.DB = settings.DB_PATH = db
+        settings.PRICES_STORAGE = "full"
+        updater.rebuild_dataset()
+        print(f"\ndataset table after rebuild_dataset")
+        check(db, end_date)
+    finally:
+        updater.DB = settings.DB_PATH = src
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,70 @@
+"""
+Parity and scoring throughput of compiled pickers (model.compiled) against sklearn
+predict_proba, for the picker types model/train.py produces, on a synthetic dataset:
+the full dataset (PredictionCache.warm) and one latest quarter, 13 rows per ticker
+(/optimize and /model/score before warm-up), in float64 and in float32 (compact
+storage). Forests are also checked on rows with missing values; decision trees and
+gradient boosting are checked to be left uncompiled.
+
+    python -m benchmarks.compiled_pickers [n_tickers] [train_rows]
+"""
+import sys
+import time
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.svm import LinearSVC
+from sklearn.tree import DecisionTreeClassifier
+
+from benchmarks.synthetic import make_dataset
+from model.compiled import compile_picker
+from services.optimization import SELECT_THRESHOLD, feature_matrix, predict_matrix
+
+PICKERS = {
+    "rf": lambda: RandomForestClassifier(random_state=42, n_estimators=100, n_jobs=1),
+    "log_reg_l2": lambda: LogisticRegression(solver="liblinear"),
+    "lin_svm": lambda: LinearSVC(random_state=42, dual="auto", C=1.0, max_iter=10000),
+}
+
+
+def main(n_tickers: int = 500, train_rows: int = 20_000):
+    dataset = make_dataset(n_tickers)
+    X = feature_matrix(dataset)
+    rng = np.random.default_rng(0)
+    # a label the features partly explain, so trees grow real splits
+    y = (X[:, 0] + 0.5 * X[:, 1] - 0.3 * X[:, 2] * X[:, 3] + rng.normal(0, 1, len(X)) > 0).astype(int)
+    train = rng.choice(len(X), train_rows, replace=False)
+    print(f"{n_tickers} tickers: scoring {X.shape[0]} rows x {X.shape[1]} features, trained on {train_rows}")
+
+    quarter = X[rng.choice(len(X), 13 * n_tickers, replace=False)]
+    missing = X.copy()
+    missing[rng.random(X.shape) < 0.01] = np.nan
+    gbm = GradientBoostingClassifier(random_state=42, n_estimators=10).fit(X[train], y[train])
+    assert compile_picker(gbm) is None
+    assert compile_picker(DecisionTreeClassifier(random_state=42).fit(X[train], y[train])) is None
+
+    for name, make in PICKERS.items():
+        picker = make().fit(X[train], y[train])
+        compiled = compile_picker(picker)
+
+        timings = []
+        for batch in (X, quarter, X.astype(np.float32)):
+            t0 = time.perf_counter()
+            ref = predict_matrix(batch, picker)
+            t_ref = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            out = predict_matrix(batch, compiled)
+            t_new = time.perf_counter() - t0
+
+            diff = np.abs(out - ref).max()
+            assert diff < 1e-12, (name, len(batch), diff)
+            assert ((out > SELECT_THRESHOLD) == (ref > SELECT_THRESHOLD)).all(), name
+            timings.append(f"{len(batch)} {batch.dtype} rows: sklearn {t_ref * 1000:.1f}ms, compiled {t_new * 1000:.1f}ms ({t_ref / t_new:.1f}x)")
+        if compiled.kind == "forest":
+            assert np.array_equal(predict_matrix(missing, picker), predict_matrix(missing, compiled)), name
+        print(f"{name:>10}: " + "\n            ".join(timings))
+    print("compiled probabilities match sklearn")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
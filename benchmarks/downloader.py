@@ -0,0 +1,64 @@
+"""
+Offline benchmark of the chunked price downloader against recorded CSVs,
+plus a resume run after a chunk fails.
+
+    python -m benchmarks.downloader [n_tickers] [latency_ms]
+"""
+import sys
+import time
+import shutil
+import tempfile
+
+from benchmarks.synthetic import make_prices
+from model.price import CsvSource, record_prices, download_prices
+
+
+class FlakySource(CsvSource):
+    """Fails every fetch that includes `bad_ticker` until `fail` is cleared."""
+
+    def __init__(self, directory: str, latency: float, bad_ticker: str):
+        super().__init__(directory, latency)
+        self.bad_ticker = bad_ticker
+        self.fail = True
+        self.fetched = 0
+
+    def fetch(self, tickers, start, end, interval):
+        if self.fail and self.bad_ticker in tickers:
+            raise ConnectionError("simulated outage")
+        self.fetched += len(tickers)
+        return super().fetch(tickers, start, end, interval)
+
+
+def main(n_tickers: int = 500, latency_ms: int = 20):
+    tmp = tempfile.mkdtemp()
+    try:
+        prices = make_prices(n_tickers, start="2024-01-01").assign(
+            close=lambda d: d["price"], high=lambda d: d["price"], low=lambda d: d["price"],
+            open=lambda d: d["price"], volume=1_000,
+        ).drop(columns="price")
+        record_prices(prices, f"{tmp}/csv")
+        tickers = sorted(prices["ticker"].unique())
+        source = CsvSource(f"{tmp}/csv", latency=latency_ms / 1000)
+
+        for workers in (1, 4, 16):
+            t0 = time.perf_counter()
+            df = download_prices(tickers, start="2024-01-01", source=source, chunk_size=25, workers=workers)
+            print(f"workers={workers:>2}: {time.perf_counter() - t0:6.2f}s, {len(df)} rows")
+
+        flaky = FlakySource(f"{tmp}/csv", latency_ms / 1000, bad_ticker=tickers[-1])
+        kwargs = dict(start="2024-01-01", source=flaky, chunk_size=25, workers=4, retries=1, backoff=0.01,
+                      checkpoint_dir=f"{tmp}/checkpoints")
+        try:
+            download_prices(tickers, **kwargs)
+        except ConnectionError:
+            print(f"first run failed after fetching {flaky.fetched} tickers")
+        flaky.fail, flaky.fetched = False, 0
+        df = download_prices(tickers, **kwargs)
+        print(f"resumed run fetched {flaky.fetched} tickers, {len(df)} rows")
+        assert len(df) == len(prices)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,94 @@
+"""
+Throughput and parity of the batched normalize_fundamentals against the original
+per-ticker loop, on a wide synthetic fundamentals table.
+
+    python -m benchmarks.fundamentals [n_tickers] [quarters] [extra_metrics]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from model.features import normalize_fundamentals, signed_log, winsorize_mad, robust_z
+
+PER_SHARE = ['Book Value Per Share', 'Free Cash Flow Per Share', 'Operating Cash Flow Per Share']
+MARGINS_RATIOS = [
+    'Asset Turnover', 'Current Ratio', 'Debt/Equity Ratio',
+    'EBIT Margin', 'Gross Margin', 'Net Profit Margin', 'Operating Margin',
+    'Pre-Tax Profit Margin', 'ROA - Return On Assets',
+    'ROE - Return On Equity', 'ROI - Return On Investment',
+    'Return On Tangible Equity', 'Inventory Turnover Ratio',
+    'Days Sales In Receivables', 'Receiveable Turnover',
+    'Long-term Debt / Capital'
+]
+
+
+def normalize_reference(df: pd.DataFrame):
+    """normalize_fundamentals as it was before batching."""
+    df = df.copy()
+    df['date'] = pd.to_datetime(df['date'])
+
+    cleaned_frames = []
+    for _, g in df.groupby('ticker'):
+        g = g.copy()
+        g[PER_SHARE] = g[PER_SHARE].apply(signed_log)
+        g[MARGINS_RATIOS] = g[MARGINS_RATIOS].apply(winsorize_mad)
+        cleaned_frames.append(g)
+
+    df_clean = pd.concat(cleaned_frames, ignore_index=True)
+
+    feature_cols = [c for c in df_clean.columns if c not in ('ticker', 'date')]
+    df_clean[feature_cols] = (
+        df_clean
+        .groupby('date')[feature_cols]
+        .transform(robust_z)
+    )
+
+    for col in feature_cols:
+        df_clean[f'{col}_na'] = df_clean[col].isna().astype(int)
+    df_clean[feature_cols] = df_clean[feature_cols].fillna(0)
+
+    return df_clean
+
+
+def make_fundamentals(n_tickers: int = 1000, quarters: int = 80, extra: int = 40, seed: int = 0) -> pd.DataFrame:
+    """
+    Quarterly (ticker, date, metrics...) rows in shuffled order. Outliers exercise the
+    MAD clip, scattered NaNs and all-NaN tickers the no-clip and pass-through paths,
+    and staggered listings leave single-ticker report dates.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end="2025-01-01", periods=quarters, freq="QE")
+    frames = []
+    for i in range(n_tickers):
+        first = int(rng.integers(0, quarters - 1))
+        d = dates[first:] + pd.Timedelta(days=int(rng.integers(0, 3)))
+        frames.append(pd.DataFrame({"ticker": f"T{i:04d}", "date": d.strftime("%Y-%m-%d")}))
+    df = pd.concat(frames, ignore_index=True)
+
+    for col in PER_SHARE + MARGINS_RATIOS + [f"Metric {j}" for j in range(extra)]:
+        values = rng.standard_t(3, len(df)) * rng.uniform(0.1, 10)
+        values[rng.random(len(df)) < 0.01] = np.nan
+        df[col] = values
+    df.loc[df["ticker"].isin([f"T{i:04d}" for i in range(0, n_tickers, 50)]), MARGINS_RATIOS[:3]] = np.nan
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def main(n_tickers: int = 1000, quarters: int = 80, extra: int = 40):
+    df = make_fundamentals(n_tickers, quarters, extra)
+    print(f"{len(df)} rows x {df.shape[1] - 2} metrics")
+
+    t0 = time.perf_counter()
+    out = normalize_fundamentals(df)
+    t_new = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ref = normalize_reference(df)
+    t_ref = time.perf_counter() - t0
+
+    pd.testing.assert_frame_equal(out, ref, check_exact=False, rtol=1e-9, atol=1e-12)
+    print(f"per-ticker loop {t_ref:.2f}s ({len(df) / t_ref:,.0f} rows/s), "
+          f"batched {t_new:.2f}s ({len(df) / t_new:,.0f} rows/s), outputs match")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
@@ -0,0 +1,122 @@
+"""
+Consistency check of the incremental dataset rebuild against a full rebuild.
+
+On a copy of the DB the last `weeks` of prices are held back (twice that for one
+ticker, and all of another's), a full rebuild is run, the prices are restored and
+the dataset is extended incrementally. The appended rows must match a full rebuild
+over all prices, within tolerance; the drift of the earlier rows is reported. With
+DATASET_MAX_EXTEND_WEEKS reached, the next incremental rebuild must be a full one.
+It runs with the held back prices starting on a Saturday and on a Thursday, when the
+first rebuild's last week is partial and has to be recomputed.
+
+    python -m benchmarks.incremental_rebuild [weeks]
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import numpy as np
+import pandas as pd
+
+from config import settings
+from services import updater
+
+ATOL = 1e-5  # RSI is recursively smoothed, the trailing window only approximates its seed
+TECH_COLUMNS = [
+    "close", "volume", "bb_pr_up", "bb_pr_dn", "rsi_13w", "mom_13w", "mom_26w", "lr_slope_13w",
+    "ma_pr_26w", "ma_pr_52w", "ret_13w", "ret_26w", "vol_13w", "ret_div_vol_13w", "close_raw",
+    "beta_13w", "beta_26w", "corr_rtn_spyrtn_13w", "excess_13w", "excess_26w", "corr_rtn_volume_13w",
+]
+
+
+def _rebuild(db: str, incremental: bool = False) -> float:
+    updater.DB = settings.DB_PATH = db
+    settings.FEATURE_STORE_DIR = db + ".features"
+    t0 = time.perf_counter()
+    updater.rebuild_dataset(incremental=incremental)
+    return time.perf_counter() - t0
+
+
+def check(src: str, weeks: int, mid_week: bool):
+    tmp = tempfile.mkdtemp()
+    settings.SNAPSHOT_DIR = os.path.join(tmp, "snapshot")
+    inc_db, full_db = os.path.join(tmp, "inc.db"), os.path.join(tmp, "full.db")
+    shutil.copy(src, inc_db)
+    shutil.copy(src, full_db)
+    try:
+        con = sqlite3.connect(inc_db)
+        last = pd.Timestamp(con.execute("SELECT MAX(date) FROM prices").fetchone()[0])
+        # prices up to a Friday, or up to the Wednesday after it
+        friday = pd.offsets.Week(weekday=4).rollback(last - pd.Timedelta(weeks=weeks))
+        cutoff = str(friday + pd.Timedelta(days=5 if mid_week else 0))
+        tickers = [t for (t,) in con.execute("SELECT DISTINCT ticker FROM prices ORDER BY ticker")]
+        stale, added = tickers[0], tickers[1]
+        stale_cutoff = str(last - pd.Timedelta(weeks=2 * weeks))
+        held_back = "(date > ? OR (ticker = ? AND date > ?) OR ticker = ?)"
+        con.execute(f"DELETE FROM prices WHERE {held_back}", (cutoff, stale, stale_cutoff, added))
+        con.execute("DELETE FROM spy WHERE date > ?", (cutoff,))
+        con.commit()
+        _rebuild(inc_db)
+
+        # restore the held back prices, then extend
+        con.execute("ATTACH DATABASE ? AS src", (src,))
+        con.execute(f"INSERT INTO prices SELECT * FROM src.prices WHERE {held_back}", (cutoff, stale, stale_cutoff, added))
+        con.execute("INSERT INTO spy SELECT * FROM src.spy WHERE date > ?", (cutoff,))
+        con.commit()
+        con.close()
+        settings.DATASET_MAX_EXTEND_WEEKS = weeks + 1
+        t_inc = _rebuild(inc_db, incremental=True)
+        t_full = _rebuild(full_db)
+
+        new_rows = "date > ? OR (ticker = ? AND date > ?) OR ticker = ?"
+        query = f"SELECT * FROM dataset WHERE {new_rows} ORDER BY ticker, date"
+        params = (cutoff, stale, stale_cutoff, added)
+        inc = pd.read_sql(query, sqlite3.connect(inc_db), params=params)
+        full = pd.read_sql(query, sqlite3.connect(full_db), params=params)
+        query = f"SELECT * FROM dataset WHERE NOT ({new_rows}) ORDER BY ticker, date"
+        inc_old = pd.read_sql(query, sqlite3.connect(inc_db), params=params)
+        full_old = pd.read_sql(query, sqlite3.connect(full_db), params=params)
+
+        # the appended weeks now reach the bound: the next incremental rebuild is a full one
+        con = sqlite3.connect(inc_db)
+        settings.DATASET_MAX_EXTEND_WEEKS = int(updater.extended_weeks(con))
+        con.close()
+        _rebuild(inc_db, incremental=True)
+        query = "SELECT * FROM dataset ORDER BY ticker, date"
+        realigned = pd.read_sql(query, sqlite3.connect(inc_db))
+        full_all = pd.read_sql(query, sqlite3.connect(full_db))
+    finally:
+        updater.DB = settings.DB_PATH = src
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(f"\nprices held back after {cutoff}")
+    print(f"full rebuild {t_full:.1f}s, incremental {t_inc:.1f}s, {len(inc)} new rows ({stale} {2 * weeks} weeks behind, {added} new)")
+    assert len(inc) == len(full), f"{len(inc)} appended rows, full rebuild has {len(full)}"
+    assert (inc[["ticker", "date"]].values == full[["ticker", "date"]].values).all()
+
+    # fundamentals are carried from the last row, so only technicals are compared
+    tech_cols = [c for c in TECH_COLUMNS if c in full.columns]
+    a, b = inc[tech_cols].to_numpy(dtype=float), full[tech_cols].to_numpy(dtype=float)
+    err = pd.Series(np.nanmax(np.abs(a - b), axis=0), index=tech_cols)
+    print(err.sort_values(ascending=False).head().to_string())
+    assert (np.isnan(a) == np.isnan(b)).all()
+    assert err.max() < ATOL
+
+    # earlier rows keep the moments they were z-scored with
+    a, b = inc_old[tech_cols].to_numpy(dtype=float), full_old[tech_cols].to_numpy(dtype=float)
+    print(f"earlier rows drift from a full rebuild by up to {np.nanmax(np.abs(a - b)):.2e}")
+    assert (realigned[["ticker", "date"]].values == full_all[["ticker", "date"]].values).all()
+    np.testing.assert_array_equal(realigned[tech_cols].to_numpy(dtype=float), full_all[tech_cols].to_numpy(dtype=float))
+    print("full rebuild forced at DATASET_MAX_EXTEND_WEEKS matches")
+
+
+def main(weeks: int = 8):
+    src = settings.DB_PATH
+    for mid_week in (False, True):
+        check(src, weeks, mid_week)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,83 @@
+"""
+Per-request latency and peak memory of PricesCache reads, comparing the old
+deep-copy accessors with snapshot views.
+
+    python -m benchmarks.prices_cache [n_tickers] [n_requests]
+"""
+import sys
+import time
+import tracemalloc
+import multiprocessing as mp
+import pandas as pd
+
+from benchmarks.synthetic import make_prices, make_dataset
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+def _peak_rss_mb() -> float:
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def _request(prices: pd.DataFrame, dataset: pd.DataFrame, cutoff, tickers):
+    # what /optimize and /stats/charts do with the cached tables
+    dataset = dataset[dataset["date"] <= cutoff]
+    prices = prices[prices["date"] <= cutoff]
+    return prices[prices["ticker"].isin(tickers)], dataset
+
+
+def _run(mode: str, n_tickers: int, n_requests: int, out):
+    from services.dataset import PricesCache, Snapshot
+
+    prices, dataset = make_prices(n_tickers), make_dataset(n_tickers)
+    PricesCache._snapshot = Snapshot.from_frames(prices, dataset)
+    del prices, dataset
+    rss_loaded = _peak_rss_mb()
+
+    if mode == "copy":
+        get = lambda: (PricesCache.snapshot()._prices.copy(), PricesCache.snapshot()._dataset.copy())
+    else:
+        get = lambda: (PricesCache.get_prices(), PricesCache.get_dataset())
+
+    cutoffs = pd.date_range("2015-01-01", "2024-12-31", periods=n_requests)
+    tickers = [f"T{i:04d}" for i in range(0, n_tickers, 25)]
+    tracemalloc.start()
+    latencies = []
+    for cutoff in cutoffs:
+        t0 = time.perf_counter()
+        _request(*get(), cutoff, tickers)
+        latencies.append(time.perf_counter() - t0)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = pd.Series(latencies) * 1000
+    out.put({
+        "mode": mode,
+        "p50_ms": latencies.median(),
+        "p95_ms": latencies.quantile(0.95),
+        "traced_peak_mb": traced_peak / 1024 ** 2,
+        "rss_loaded_mb": rss_loaded,
+        "rss_peak_mb": _peak_rss_mb(),
+    })
+
+
+def main(n_tickers: int = 500, n_requests: int = 20):
+    ctx = mp.get_context("spawn")
+    rows = []
+    for mode in ("copy", "snapshot"):
+        out = ctx.Queue()
+        proc = ctx.Process(target=_run, args=(mode, n_tickers, n_requests, out))
+        proc.start()
+        rows.append(out.get())
+        proc.join()
+    print(pd.DataFrame(rows).set_index("mode").round(1).to_string())
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
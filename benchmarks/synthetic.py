@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+
+def make_prices(n_tickers: int = 500, start: str = "2007-01-01", end: str = "2025-01-01", seed: int = 0) -> pd.DataFrame:
+    """Long (date, ticker, price) frame shaped like PricesCache prices."""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, end)
+    frames = []
+    for i in range(n_tickers):
+        first = int(rng.integers(0, len(dates) // 2))
+        d = dates[first:]
+        price = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, len(d))))
+        frames.append(pd.DataFrame({"date": d, "ticker": f"T{i:04d}", "price": price}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def make_dataset(n_tickers: int = 500, n_features: int = 60, start: str = "2007-01-01", end: str = "2025-01-01", seed: int = 0) -> pd.DataFrame:
+    """Weekly long frame with feature, `_na`, quarter and label columns shaped like the dataset table."""
+    rng = np.random.default_rng(seed)
+    weeks = pd.date_range(start, end, freq="W-FRI")
+    n = len(weeks)
+    tickers = np.repeat([f"T{i:04d}" for i in range(n_tickers)], n)
+    df = pd.DataFrame({"ticker": tickers, "date": np.tile(weeks, n_tickers)})
+    for j in range(n_features):
+        df[f"f{j}"] = rng.normal(size=len(df))
+    for j in range(n_features // 3):
+        df[f"f{j}_na"] = (rng.random(len(df)) < 0.05).astype(int)
+    df["close_raw"] = 50 * np.exp(rng.normal(0, 0.02, len(df)).reshape(n_tickers, n).cumsum(axis=1).ravel())
+    df["quarter_id"] = np.tile(np.arange(n) // 13 + 1, n_tickers)
+    df["since_quarter_start"] = np.tile((np.arange(n) % 13) / 13, n_tickers)
+    df["outperformed"] = rng.integers(0, 2, len(df))
+    return df
@@ -0,0 +1,86 @@
+"""
+Parity check and timing of the wide technicals engine against the per-ticker TA-Lib loop.
+
+The synthetic weekly panel has staggered listings, dropped weeks, tickers shorter
+than the longest window, flat stretches and a benchmark that starts late, so the
+edge cases of both engines are exercised.
+
+    python -m benchmarks.technicals [n_tickers]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from model.features import generate_technicals
+
+RTOL = 1e-7
+ATOL = 1e-9
+
+
+def make_weekly(n_tickers: int = 500, start: str = "2005-01-01", end: str = "2025-01-01", seed: int = 0):
+    """Weekly (ticker, date, close, volume) frame plus a (date, close) benchmark."""
+    rng = np.random.default_rng(seed)
+    weeks = pd.date_range(start, end, freq="W-FRI")
+    frames = []
+    for i in range(n_tickers):
+        first = int(rng.integers(0, len(weeks) - 10))
+        last = len(weeks) if i % 10 else first + int(rng.integers(5, 60))  # some short histories
+        d = weeks[first:last]
+        keep = rng.random(len(d)) > 0.02  # gaps like resample_weekly(...).dropna()
+        close = 50 * np.exp(np.cumsum(rng.normal(0.001, 0.04, len(d))))
+        if i % 7 == 0 and len(d) > 40:
+            close[10:30] = close[10]  # flat stretch: zero variance windows
+        volume = rng.lognormal(12, 1, len(d)).round()
+        frames.append(pd.DataFrame({"ticker": f"T{i:04d}", "date": d, "close": close, "volume": volume})[keep])
+    # a long trending, high-priced series: windows sit far from the whole-history mean
+    trend = np.linspace(0, 1, len(weeks))
+    frames.append(pd.DataFrame({
+        "ticker": "TREND",
+        "date": weeks,
+        "close": np.exp(np.log(5) + trend * np.log(60000 / 5) + rng.normal(0, 0.01, len(weeks))),
+        "volume": np.exp(np.log(1e3) + trend * np.log(1e9 / 1e3) + rng.normal(0, 0.3, len(weeks))).round(),
+    }))
+    prices = pd.concat(frames, ignore_index=True)
+
+    spy_weeks = weeks[52:]
+    spy = pd.DataFrame({"date": spy_weeks, "close": 100 * np.exp(np.cumsum(rng.normal(0.001, 0.02, len(spy_weeks))))})
+    return prices, spy
+
+
+def check(ref: pd.DataFrame, out: pd.DataFrame):
+    assert list(ref.columns) == list(out.columns), (list(ref.columns), list(out.columns))
+    assert (ref.index == out.index).all()
+    assert (ref[["ticker", "date"]].to_numpy() == out[["ticker", "date"]].to_numpy()).all()
+    worst = {}
+    for col in ref.columns.drop(["ticker", "date"]):
+        a, b = ref[col].to_numpy(dtype=float), out[col].to_numpy(dtype=float)
+        assert (np.isnan(a) == np.isnan(b)).all(), f"{col}: NaN pattern differs"
+        assert (np.isinf(a) == np.isinf(b)).all(), f"{col}: inf pattern differs"
+        ok = np.isfinite(a)
+        np.testing.assert_allclose(b[ok], a[ok], rtol=RTOL, atol=ATOL, err_msg=col)
+        worst[col] = np.max(np.abs(b[ok] - a[ok]), initial=0)
+    return worst
+
+
+def main(n_tickers: int = 500):
+    prices, spy = make_weekly(n_tickers)
+    print(f"{n_tickers} tickers, {len(prices)} weekly rows")
+
+    for benchmark in (spy, None):
+        t0 = time.perf_counter()
+        ref = generate_technicals(prices, benchmark, engine="ticker")
+        t_ref = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        out = generate_technicals(prices, benchmark, engine="wide")
+        t_wide = time.perf_counter() - t0
+
+        worst = check(ref, out)
+        label = "with benchmark" if benchmark is not None else "no benchmark"
+        print(f"{label}: per-ticker {t_ref:.2f}s, wide {t_wide:.2f}s ({t_ref / t_wide:.1f}x), outputs match")
+        for col, err in worst.items():
+            print(f"  {col:<20} {err:.3e}")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
@@ -6,8 +6,43 @@ load_dotenv()
 
 class Settings(BaseSettings):
     DB_PATH: str = os.getenv("DB_PATH", "model/data/data.db")
+    SNAPSHOT_DIR: str = os.getenv("SNAPSHOT_DIR", "model/data/snapshot")
+    # "full" (float64/datetime64) or "compact" (categorical tickers, int32 days, float32 features)
+    PRICES_STORAGE: str = os.getenv("PRICES_STORAGE", "full")
+    # uvicorn workers; with more than one, the parent process loads and publishes the snapshot
+    WEB_WORKERS: int = int(os.getenv("WEB_WORKERS", 1))
+    PRICES_ATTACH: bool = os.getenv("PRICES_ATTACH", "0") == "1"
+    # run the reminder and update scheduler in this process; the multi-worker parent
+    # runs it itself and clears this for its workers
+    RUN_SCHEDULER: bool = os.getenv("RUN_SCHEDULER", "1") == "1"
+    SNAPSHOT_POLL_SECONDS: int = int(os.getenv("SNAPSHOT_POLL_SECONDS", 60))
+
+    # chunked price downloads; finished chunks are checkpointed so a failed update resumes
+    DOWNLOAD_CHUNK_SIZE: int = int(os.getenv("DOWNLOAD_CHUNK_SIZE", 100))
+    DOWNLOAD_WORKERS: int = int(os.getenv("DOWNLOAD_WORKERS", 4))
+    DOWNLOAD_CHECKPOINT_DIR: str = os.getenv("DOWNLOAD_CHECKPOINT_DIR", "model/data/download")
+
+    # processes for the full dataset rebuild; tickers are sharded across them
+    DATASET_WORKERS: int = int(os.getenv("DATASET_WORKERS", 1))
+    # technicals engine of the dataset rebuilds: "ticker" (TA-Lib per ticker) or "wide"
+    TECHNICALS_ENGINE: str = os.getenv("TECHNICALS_ENGINE", "ticker")
+    # incremental rebuilds z-score new rows with updated moments and leave earlier rows
+    # as they were; after this many appended weeks a full rebuild realigns the table
+    DATASET_MAX_EXTEND_WEEKS: int = int(os.getenv("DATASET_MAX_EXTEND_WEEKS", 13))
+    # content-addressed feature blocks reused by rebuilds, training and the snapshot
+    FEATURE_STORE_DIR: str = os.getenv("FEATURE_STORE_DIR", "model/data/features")
 
     ML_PICKERS_DIR: str = os.getenv("ML_PICKERS_DIR", "model/pickers")
+    # joblib processes fitting models and walk-forward folds in model/train.py (-1: one per CPU)
+    TRAIN_WORKERS: int = int(os.getenv("TRAIN_WORKERS", -1))
+    # loaded pickers kept in memory (by file size), and joblib mmap_mode for their arrays ("" to disable)
+    PICKER_CACHE_MB: int = int(os.getenv("PICKER_CACHE_MB", 512))
+    PICKER_MMAP_MODE: str = os.getenv("PICKER_MMAP_MODE", "r")
+    # serve random forest and linear pickers through model.compiled instead of sklearn
+    # (python -m benchmarks.compiled_pickers); other pickers are served as loaded
+    PICKER_COMPILE: bool = os.getenv("PICKER_COMPILE", "0") == "1"
+    # threads scoring pickers side by side in /model/score
+    SCORE_WORKERS: int = int(os.getenv("SCORE_WORKERS", 4))
     RISK_MODELS: list[str] = ["mean_variance", "ledoit_wolf", "nco", "equal"]
 
     FINVIZ_API_KEY: str = os.getenv("FINVIZ_API_KEY")
@@ -21,6 +56,8 @@ class Settings(BaseSettings):
     REMINDER_COLLECTION: str = os.getenv("REMINDER_COLLECTION", "reminders")
     JOBSTORE_COLLECTION: str = os.getenv("JOBSTORE_COLLECTION", "apscheduler_jobs")
     UPDATES_COLLECTION: str = os.getenv("UPDATES_COLLECTION", "updates")
+    # how often the scheduling process applies reminder changes made by other workers
+    REMINDER_SYNC_SECONDS: int = int(os.getenv("REMINDER_SYNC_SECONDS", 30))
 
 
 settings = Settings()
@@ -1,3 +1,6 @@
+import os
+import asyncio
+import threading
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
@@ -5,10 +8,12 @@ import motor.motor_asyncio
 
 from config import settings
 from services.updater import run_full_update
-from services.dataset import PricesCache
+from services.dataset import PricesCache, ensure_snapshot
 from services.registry import ModelRegistry
+from services.predictions import PredictionCache
+from services.reminders import init_scheduler
 
-from api import pickers, risk, optimize, market, portfolios, user, reminders, stats
+from api import pickers, risk, optimize, market, portfolios, user, reminders, stats, health
 
 app = FastAPI()
 
@@ -20,17 +25,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+async def background_update():
+    # the cache already serves the last good snapshot; run_full_update publishes
+    # a new one and reloads the cache when it finishes
+    try:
+        await asyncio.to_thread(run_full_update)
+    except Exception as e:
+        print(f"Background update failed: {e}")
+
 @app.on_event("startup")
 async def startup_event():
-    run_full_update()
-
-    PricesCache.load()
-
     ModelRegistry.scan(settings.ML_PICKERS_DIR)
+    # score every picker on each snapshot the cache starts serving
+    PricesCache.on_publish(PredictionCache.warm)
+
+    await asyncio.to_thread(PricesCache.load)
+    if settings.PRICES_ATTACH:
+        PricesCache.watch(settings.SNAPSHOT_POLL_SECONDS)
 
     client = motor.motor_asyncio.AsyncIOMotorClient(settings.MONGODB_URI)
     app.state.db = client[settings.MONGODB_DB]
 
+    app.state.update_task = None
+    if not settings.PRICES_ATTACH:
+        app.state.update_task = asyncio.create_task(background_update())
+
 app.include_router(pickers.router, prefix="/model")
 app.include_router(risk.router, prefix="/risk")
 app.include_router(optimize.router)
@@ -39,6 +58,17 @@ app.include_router(portfolios.router)
 app.include_router(user.router)
 app.include_router(reminders.router)
 app.include_router(stats.router)
+app.include_router(health.router)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if settings.WEB_WORKERS > 1:
+        # single loader: publish the snapshot and run updates and scheduled jobs here,
+        # workers attach to the memory-mapped snapshot read-only and poll for new versions
+        ensure_snapshot()
+        threading.Thread(target=run_full_update, daemon=True).start()
+        init_scheduler()
+        os.environ["PRICES_ATTACH"] = "1"
+        os.environ["RUN_SCHEDULER"] = "0"
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=settings.WEB_WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,105 @@
+import numpy as np
+from scipy.special import expit
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.svm import LinearSVC
+
+# Fitted pickers reduced to flat arrays and scored without sklearn's per-call and
+# per-tree overhead.
+#
+# Random forests: every tree keeps its node arrays (sklearn's Tree) plus P(class 1)
+# at each node, computed once. A batch is cast to float32 and checked once
+# and walked through each tree with Tree.apply, sklearn's own Cython traversal, so
+# routing (x <= threshold, NaN to the node's missing-value side) is sklearn's; the
+# leaf probabilities are gathered and summed in tree order, as predict_proba does,
+# without its per-tree input validation, probability arrays and normalization
+# (~1.6x sklearn on a 100-tree forest; python -m benchmarks.compiled_pickers). A
+# pure NumPy walk over stacked node arrays loses to the Cython one (0.4-0.7x).
+#
+# A single decision tree is left to sklearn: its predict_proba is one cast and one
+# Tree.predict, and the compiled path only matches it on a full dataset.
+#
+# Linear pickers: expit of the decision function, as LogisticRegression's binary
+# predict_proba and the _predict_proba_lr predict_matrix reads LinearSVC through.
+#
+# Gradient boosting is left to sklearn: its predict_proba is almost all one fused
+# Cython pass over the trees (predict_stages), with nothing left to save.
+
+BATCH_ROWS = 16_384
+
+
+def _positive_fraction(value: np.ndarray) -> np.ndarray:
+    """P(class 1) at each node, as a forest tree's predict_proba reports it."""
+    value = value[:, 0, :]
+    total = value.sum(axis=1)
+    # sklearn >= 1.4 stores class fractions; older versions store counts, normalized on predict
+    if np.allclose(total, 1.0):
+        return value[:, 1].copy()
+    total[total == 0.0] = 1.0
+    return value[:, 1] / total
+
+
+class CompiledPicker:
+    """
+    Drop-in for a fitted binary picker's predict_proba, built by compile_picker().
+    kind is "forest" (mean of the trees' leaf probabilities) or "linear" (expit of
+    the decision function).
+    """
+
+    def __init__(self, kind: str, n_features: int, classes: np.ndarray, trees: list = None,
+                 leaf_values: list[np.ndarray] = None, coef: np.ndarray = None, intercept: np.ndarray = None):
+        self.kind = kind
+        self.n_features_in_ = n_features
+        self.classes_ = classes
+        self.trees = trees
+        self.leaf_values = leaf_values
+        self.coef = coef
+        self.intercept = intercept
+
+    def _positive(self, X: np.ndarray) -> np.ndarray:
+        if self.kind == "linear":
+            return expit((X @ self.coef.T + self.intercept).reshape(-1))
+
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if np.isinf(X).any():
+            raise ValueError("Input X contains infinity or a value too large for dtype('float32').")
+        out = np.zeros(len(X))
+        for tree, values in zip(self.trees, self.leaf_values):
+            out += values[tree.apply(X)]
+        return out / len(self.trees)
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = np.asarray(X)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has {X.shape[-1]} features, but the picker is expecting {self.n_features_in_} features as input.")
+        if not len(X):
+            raise ValueError(f"Found array with 0 sample(s) (shape={X.shape}) while a minimum of 1 is required.")
+        if not np.issubdtype(X.dtype, np.floating):
+            X = X.astype(np.float64)
+        # sklearn trees route NaN by node; its linear models reject it
+        if self.kind == "linear" and np.isnan(X).any():
+            raise ValueError("Input X contains NaN.")
+        p = np.concatenate([self._positive(X[i:i + BATCH_ROWS]) for i in range(0, len(X), BATCH_ROWS)])
+        return np.stack([1 - p, p], axis=1)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[(self.predict_proba(X)[:, 1] > 0.5).astype(int)]
+
+
+def compile_picker(picker):
+    """
+    CompiledPicker for a fitted binary random forest or linear (LogisticRegression,
+    LinearSVC) picker; None for anything else.
+    """
+    if len(getattr(picker, "classes_", ())) != 2:
+        return None
+    n_features, classes = picker.n_features_in_, picker.classes_
+
+    if isinstance(picker, RandomForestClassifier):
+        trees = [e.tree_ for e in picker.estimators_]
+        return CompiledPicker("forest", n_features, classes, trees, [_positive_fraction(t.value) for t in trees])
+
+    if isinstance(picker, (LogisticRegression, LinearSVC)):
+        return CompiledPicker("linear", n_features, classes, coef=np.asarray(picker.coef_), intercept=np.asarray(picker.intercept_))
+
+    return None
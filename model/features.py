@@ -3,6 +3,8 @@ import numpy as np
 import talib
 import sqlite3
 
+from model.rolling import RollingMoments
+
 
 def winsorize_mad(series: pd.Series, k=3):
     """Robust clip at median +- k*MAD."""
@@ -47,39 +49,43 @@ def normalize_fundamentals(df: pd.DataFrame):
     ]
 
     # ---------- 1. ticker standardisation ----------
-    cleaned_frames = []
-    for _, g in df.groupby('ticker'):
-        g = g.copy()
-
-        # log-transform dollar-per-share metrics
-        g[per_share] = g[per_share].apply(signed_log)
-
-        # winsorize all ratios / margins
-        g[margins_ratios] = g[margins_ratios].apply(winsorize_mad)
+    df = df.dropna(subset=['ticker']).sort_values('ticker', kind='stable').reset_index(drop=True)
 
-        cleaned_frames.append(g)
+    # log-transform dollar-per-share metrics
+    df[per_share] = signed_log(df[per_share])
 
-    df_clean = pd.concat(cleaned_frames, ignore_index=True)
+    # winsorize all ratios / margins at the ticker's median +- 3*MAD (winsorize_mad);
+    # like np.median there, a NaN anywhere in the ticker's column leaves it unclipped
+    ratios = df[margins_ratios]
+    by_ticker = df['ticker']
+    med = ratios.groupby(by_ticker).transform('median')
+    mad = (ratios - med).abs().groupby(by_ticker).transform('median')
+    mad = mad.where(~ratios.isna().groupby(by_ticker).transform('any'))
+    df[margins_ratios] = ratios.clip(lower=med - 3 * mad, upper=med + 3 * mad)
 
     # ---------- 2. cross-section standardisation ----------
-    feature_cols = [c for c in df_clean.columns if c not in ('ticker', 'date')]
-    df_clean[feature_cols] = (
-        df_clean
-        .groupby('date')[feature_cols]
-        .transform(robust_z)
-    )
+    feature_cols = [c for c in df.columns if c not in ('ticker', 'date')]
+    by_date = df.groupby('date')[feature_cols]
+    df[feature_cols] = (df[feature_cols] - by_date.transform('mean')) / by_date.transform('std', ddof=0)
 
-    for col in feature_cols:
-        df_clean[f'{col}_na'] = df_clean[col].isna().astype(int)
-    df_clean[feature_cols] = df_clean[feature_cols].fillna(0)
+    na = df[feature_cols].isna().astype(int).add_suffix('_na')
+    df = pd.concat([df, na], axis=1)
+    df[feature_cols] = df[feature_cols].fillna(0)
 
-    return df_clean
+    return df
 
-def generate_technicals(df: pd.DataFrame, benchmark_df: pd.DataFrame = None):
+def generate_technicals(df: pd.DataFrame, benchmark_df: pd.DataFrame = None, engine: str = 'ticker'):
     """
     df: DataFrame with columns ['ticker', 'date', 'open', 'high', 'low', 'close', 'volume']
     benchmark_df: optional DataFrame with 'date' and 'close' columns for SPX or other index
+    engine: 'ticker' (default) is the reference TA-Lib loop over df.groupby('ticker'),
+            'wide' computes every ticker at once on a (row x ticker) matrix
+            (python -m benchmarks.technicals checks the two agree)
     """
+    if engine == 'wide':
+        return _technicals_wide(df, benchmark_df)
+    if engine != 'ticker':
+        raise ValueError(f"Unknown technicals engine: {engine}")
     df = df.sort_values(['ticker', 'date']).copy()
 
     feature_frames = []
@@ -165,6 +171,115 @@ def generate_technicals(df: pd.DataFrame, benchmark_df: pd.DataFrame = None):
 
     return final_df
 
+# ---------- wide technicals engine ---------- #
+# Each ticker is a column and each row its i-th weekly bar (the per-ticker position,
+# not the calendar week), so every window and shift sees exactly the rows the
+# per-ticker loop does, including across gaps in a ticker's history.
+
+def _shift(x: np.ndarray, n: int) -> np.ndarray:
+    out = np.full(x.shape, np.nan)
+    out[n:] = x[:-n]
+    return out
+
+def _pct_change(x: np.ndarray) -> np.ndarray:
+    return x / _shift(x, 1) - 1
+
+def _rsi(x: np.ndarray, n: int) -> np.ndarray:
+    """TA-Lib RSI (Wilder smoothing seeded with the mean of the first n moves), one row at a time."""
+    out = np.full(x.shape, np.nan)
+    if len(x) <= n:
+        return out
+    diff = np.diff(x, axis=0)
+    gain, loss = np.clip(diff, 0, None), np.clip(-diff, 0, None)
+    avg_gain, avg_loss = gain[:n].mean(axis=0), loss[:n].mean(axis=0)
+
+    def value(g, l):
+        total = g + l
+        # TA-Lib treats |total| < 1e-14 as zero and reports 0
+        return np.where(np.abs(total) < 1e-14, 0.0, 100 * g / np.where(total == 0, 1, total))
+
+    out[n] = value(avg_gain, avg_loss)
+    for i in range(n + 1, len(x)):
+        avg_gain = (avg_gain * (n - 1) + gain[i - 1]) / n
+        avg_loss = (avg_loss * (n - 1) + loss[i - 1]) / n
+        out[i] = value(avg_gain, avg_loss)
+    return out
+
+def _technicals_wide(df: pd.DataFrame, benchmark_df: pd.DataFrame = None):
+    """Same columns and row order as the per-ticker engine."""
+    df = df.sort_values(['ticker', 'date'])
+    codes, tickers = pd.factorize(df['ticker'], sort=True)
+    pos = df.groupby('ticker').cumcount().to_numpy()
+    shape = (pos.max() + 1 if len(df) else 0, len(tickers))
+
+    def wide(values) -> np.ndarray:
+        m = np.full(shape, np.nan)
+        m[pos, codes] = values
+        return m
+
+    features = {}
+    close = wide(df['close'].to_numpy(dtype=float))
+    volume = wide(df['volume'].to_numpy(dtype=float))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        px = RollingMoments(close)
+
+        # Bollinger Bands (TA-Lib: SMA +- 2 population std)
+        middle = px.mean(13)
+        band = 2 * px.std(13, ddof=0)
+        features['bb_pr_up'] = np.log(close / (middle + band))
+        ratio = close / (middle - band)
+        features['bb_pr_dn'] = np.log(np.where(ratio > 0, ratio, np.nan))
+
+        features['rsi_13w'] = _rsi(close, 13)
+        features['mom_13w'] = close - _shift(close, 13)
+        features['mom_26w'] = close - _shift(close, 26)
+        features['lr_slope_13w'] = px.slope(13)
+        features['ma_pr_26w'] = np.log(close / px.mean(26))
+        features['ma_pr_52w'] = np.log(close / px.mean(52))
+
+        ret_13w = close / _shift(close, 13) - 1
+        ret_26w = close / _shift(close, 26) - 1
+        features['ret_13w'] = ret_13w
+        features['ret_26w'] = ret_26w
+
+        daily_ret = _pct_change(close)
+        ret = RollingMoments(daily_ret)
+        vol_13w = ret.std(13)
+        features['vol_13w'] = vol_13w
+        features['ret_div_vol_13w'] = ret_13w / vol_13w
+
+        if benchmark_df is not None:
+            # align SPY to every (ticker, date) row once
+            by_date = df[['date']].assign(_row=np.arange(len(df))).sort_values('date')
+            spy = pd.merge_asof(by_date, benchmark_df[['date', 'close']].sort_values('date'), on='date', direction='backward')
+            close_spy = np.empty(len(df))
+            close_spy[spy['_row'].to_numpy()] = spy['close'].to_numpy(dtype=float)
+            close_spy = wide(close_spy)
+
+            features['close_raw'] = close
+            features['close_spy'] = close_spy
+
+            # pct_change() pads gaps before differencing; SPY only has leading NaNs
+            spx_ret = _pct_change(close_spy)
+            spx = RollingMoments(spx_ret)
+            features['beta_13w'] = ret.beta(spx, 13)
+            features['beta_26w'] = ret.beta(spx, 26)
+            features['corr_rtn_spyrtn_13w'] = ret.corr(spx, 13)
+            features['excess_13w'] = ret_13w - _shift(spx_ret, 13)
+            features['excess_26w'] = ret_26w - _shift(spx_ret, 26)
+        else:
+            for col in ['beta_13w', 'beta_26w', 'corr_rtn_spyrtn_13w', 'excess_13w', 'excess_26w']:
+                features[col] = np.full(shape, np.nan)
+
+        features['corr_rtn_volume_13w'] = ret.corr(RollingMoments(volume), 13)
+
+    out = df.copy()
+    out.index = pos  # the per-ticker engine resets each group's index
+    for col, m in features.items():
+        out[col] = m[pos, codes]
+    return out
+
 def resample_weekly(df: pd.DataFrame):
     """
     Expects df with ['ticker', 'date', 'close', 'volume'].
@@ -180,12 +295,18 @@ def resample_weekly(df: pd.DataFrame):
 
     return resampled
 
-def normalize_features(df: pd.DataFrame):
-    df = df.copy()
-    
-    exclude_cols = ['date', 'ticker', 'corr_rtn_volume_13w', 'corr_rtn_spyrtn_13w', 'rsi_13w', 'volume', 'close_raw', 'close_spy']
-    feature_cols = [col for col in df.columns if col not in exclude_cols]
-    normalized_frames = []
+# columns generate_technicals adds to its input (with a benchmark)
+TECHNICAL_COLUMNS = [
+    'bb_pr_up', 'bb_pr_dn', 'rsi_13w', 'mom_13w', 'mom_26w', 'lr_slope_13w', 'ma_pr_26w', 'ma_pr_52w',
+    'ret_13w', 'ret_26w', 'vol_13w', 'ret_div_vol_13w', 'close_raw', 'close_spy', 'beta_13w', 'beta_26w',
+    'corr_rtn_spyrtn_13w', 'excess_13w', 'excess_26w', 'corr_rtn_volume_13w',
+]
+
+NORM_EXCLUDE = ['date', 'ticker', 'corr_rtn_volume_13w', 'corr_rtn_spyrtn_13w', 'rsi_13w', 'volume', 'close_raw', 'close_spy']
+
+def scale_features(df: pd.DataFrame):
+    """Per-ticker transforms applied before z-scoring: log close, RSI in [0, 1], volume z-scored over 26w."""
+    scaled_frames = []
 
     for ticker, group in df.groupby('ticker'):
         group = group.copy()
@@ -198,88 +319,147 @@ def normalize_features(df: pd.DataFrame):
         v_sigma = group['volume'].rolling(26).std()
         group['volume'] = (group['volume'] - v_mu) / v_sigma
 
-        group[feature_cols] = group[feature_cols].apply(lambda x: (x - x.mean()) / x.std())
+        scaled_frames.append(group)
 
-        normalized_frames.append(group)
+    return pd.concat(scaled_frames, axis=0).reset_index(drop=True)
+
+def feature_moments(df: pd.DataFrame):
+    """
+    Per-ticker count, mean and sum of squared deviations (m2) of the z-scored columns
+    of a scaled frame. Columns are a (stat, feature) MultiIndex, index is ticker.
+    """
+    feature_cols = [col for col in df.columns if col not in NORM_EXCLUDE]
+    g = df.groupby('ticker')[feature_cols]
+    n = g.count()
+    return pd.concat({'n': n, 'mean': g.mean(), 'm2': g.var() * (n - 1)}, axis=1)
+
+def merge_moments(a: pd.DataFrame, b: pd.DataFrame):
+    """Combine two feature_moments() results as if computed over both row sets (Chan et al.)."""
+    tickers = a.index.union(b.index)
+    a = a.reindex(tickers)
+    b = b.reindex(tickers, columns=a.columns)
+    na, nb = a['n'].fillna(0), b['n'].fillna(0)
+    n = na + nb
+    delta = b['mean'] - a['mean']
+    mean = a['mean'].where(nb == 0, a['mean'].fillna(0) + delta.fillna(b['mean']) * nb / n)
+    m2 = a['m2'].fillna(0) + b['m2'].fillna(0) + (delta ** 2 * na * nb / n).fillna(0)
+    return pd.concat({'n': n, 'mean': mean, 'm2': m2.where(n > 0)}, axis=1)
+
+def remove_moments(a: pd.DataFrame, b: pd.DataFrame):
+    """feature_moments() of a's rows without b's, for b computed over a subset of them; undoes merge_moments."""
+    b = b.reindex(a.index, columns=a.columns)
+    na, nb = a['n'].fillna(0), b['n'].fillna(0)
+    n = na - nb
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (na * a['mean'] - nb * b['mean'].fillna(0)) / n
+        delta = b['mean'] - mean
+        m2 = a['m2'] - b['m2'].fillna(0) - (delta ** 2 * n * nb / na).fillna(0)
+    mean, m2 = mean.where(nb > 0, a['mean']), m2.where(nb > 0, a['m2'])
+    return pd.concat({'n': n, 'mean': mean.where(n > 0), 'm2': m2.where(n > 0)}, axis=1)
+
+def standardize_features(df: pd.DataFrame, moments: pd.DataFrame):
+    """Z-score the features of a scaled frame with per-ticker feature_moments()."""
+    df = df.copy()
+    feature_cols = [col for col in df.columns if col not in NORM_EXCLUDE]
 
-    df_normalized = pd.concat(normalized_frames, axis=0).reset_index(drop=True)
-    return df_normalized
+    moments = moments.reindex(df['ticker'])
+    mean = moments['mean'][feature_cols].to_numpy()
+    std = np.sqrt(moments['m2'][feature_cols] / (moments['n'][feature_cols] - 1)).to_numpy()
+    df[feature_cols] = (df[feature_cols].to_numpy() - mean) / std
+
+    return df
+
+def unstandardize_features(df: pd.DataFrame, moments: pd.DataFrame):
+    """Scaled features back from ones z-scored by standardize_features with the same moments."""
+    df = df.copy()
+    feature_cols = [col for col in df.columns if col not in NORM_EXCLUDE]
+
+    moments = moments.reindex(df['ticker'])
+    mean = moments['mean'][feature_cols].to_numpy()
+    std = np.sqrt(moments['m2'][feature_cols] / (moments['n'][feature_cols] - 1)).to_numpy()
+    df[feature_cols] = df[feature_cols].to_numpy() * std + mean
+
+    return df
+
+def normalize_features(df: pd.DataFrame):
+    """Scale features and z-score them per ticker with each ticker's full-history mean/std."""
+    df = scale_features(df)
+    return standardize_features(df, feature_moments(df))
 
 def generate_labels(dataset: pd.DataFrame, fund_cols: list):
+    """
+    A quarter starts whenever a ticker's fundamentals change. Each row of a quarter with
+    at least two rows gets `outperformed` (did the stock beat SPY from the quarter's
+    first to last row) and `since_quarter_start` (row position / quarter length);
+    other quarters, or ones starting at a non-positive price, are left NaN.
+    """
     dataset = dataset.copy()
 
-    dataset['is_quarter_start'] = dataset.groupby('ticker')[fund_cols].apply(
-        lambda x: x.ne(x.shift()).any(axis=1)
-    ).astype(int).reset_index(drop=True)
+    changed = dataset[fund_cols].ne(dataset.groupby('ticker')[fund_cols].shift()).any(axis=1)
+    dataset['quarter_id'] = changed.astype(int).groupby(dataset['ticker']).cumsum()
 
-    dataset['quarter_id'] = dataset.groupby('ticker')['is_quarter_start'].cumsum()
+    # first/last row positions of each quarter (iloc[0] / iloc[-1], NaNs included)
+    quarters = dataset.groupby(['ticker', 'quarter_id'], sort=False)
+    rows = pd.Series(np.arange(len(dataset))).groupby(quarters.ngroup().to_numpy())
+    first = rows.transform('min').to_numpy()
+    last = rows.transform('max').to_numpy()
+    size = rows.transform('size').to_numpy()
 
-    labels = []
+    close, spy = dataset['close_raw'].to_numpy(), dataset['close_spy'].to_numpy()
+    price_start, price_end = close[first], close[last]
+    spy_start, spy_end = spy[first], spy[last]
 
-    for (ticker, quarter_id), group in dataset.groupby(['ticker', 'quarter_id']):
-        if len(group) < 2: continue
+    with np.errstate(divide='ignore', invalid='ignore'):
+        outperformed = (price_end / price_start - 1 > spy_end / spy_start - 1).astype(int)
+    labeled = (size >= 2) & ~(price_start <= 0) & ~(spy_start <= 0)
 
-        start = group.iloc[0]
-        end = group.iloc[-1]
+    since = quarters.cumcount().to_numpy() / size
+    dataset['since_quarter_start'] = np.where(labeled, since, np.nan)
+    dataset['outperformed'] = np.where(labeled, outperformed, np.nan)
+    if labeled.all():
+        dataset['outperformed'] = dataset['outperformed'].astype(int)
 
-        price_start = start['close_raw']
-        price_end = end['close_raw']
-        spy_start = start['close_spy']
-        spy_end = end['close_spy']
+    return dataset.reset_index(drop=True)
 
-        if price_start <= 0 or spy_start <= 0:
-            continue
 
-        stock_return = price_end / price_start - 1
-        spy_return = spy_end / spy_start - 1
-        label = int(stock_return > spy_return)
+def asof_join(left: pd.DataFrame, right: pd.DataFrame, ffill: list = ()) -> pd.DataFrame:
+    """
+    Backward as-of join of `right` onto `left` by ticker on date, i.e. a per-ticker
+    merge_asof(direction='backward'), in one searchsorted pass over both tables.
+    Returns `left` sorted by (ticker, date) with right's other columns appended;
+    the `ffill` columns are forward filled within each ticker in the same pass.
+    """
+    left = left.sort_values(['ticker', 'date'], kind='stable').reset_index(drop=True)
+    right = right.sort_values(['ticker', 'date'], kind='stable').reset_index(drop=True)
+    n = len(left)
 
-        cnt = 0
-        for i, row in group.iterrows():
-            labels.append({
-                'ticker': ticker,
-                'date': row['date'],
-                'since_quarter_start': cnt / len(group),  # not `i` cuz of indexing
-                'outperformed': label
-            })
-            cnt += 1
+    # (ticker, date) as one sortable int64: sorted ticker codes x dense date ranks
+    codes, _ = pd.factorize(pd.concat([left['ticker'], right['ticker']], ignore_index=True), sort=True)
+    _, ranks = np.unique(np.concatenate([left['date'].to_numpy(), right['date'].to_numpy()]), return_inverse=True)
+    width = ranks.max() + 1 if len(ranks) else 1
+    keys = codes.astype(np.int64) * width + ranks
+    left_code, right_code = codes[:n], codes[n:]
 
-    dataset = pd.merge(
-        dataset,
-        pd.DataFrame(labels),
-        on=['ticker', 'date'],
-        how='left'
-    ).drop(columns=['is_quarter_start'])
+    # last right row at or before each left row; ties take the last, like merge_asof
+    j = np.searchsorted(keys[n:], keys[:n], side='right') - 1
+    matched = (j >= 0) & (right_code[np.maximum(j, 0)] == left_code) if len(right) else np.zeros(n, dtype=bool)
+    joined = right.drop(columns=['ticker', 'date']).reindex(np.where(matched, j, -1)).reset_index(drop=True)
 
-    return dataset
+    if len(ffill):
+        rows = np.arange(n)
+        group_start = np.maximum.accumulate(np.where(np.r_[True, left_code[1:] != left_code[:-1]], rows, 0))
+        for col in ffill:
+            last_valid = np.maximum.accumulate(np.where(joined[col].notna().to_numpy(), rows, -1))
+            joined[col] = joined[col].reindex(np.where(last_valid >= group_start, last_valid, -1)).to_numpy()
+
+    return pd.concat([left, joined], axis=1)
 
 
 def merge(tech: pd.DataFrame, fund: pd.DataFrame) -> pd.DataFrame:
     tech['date'] = pd.to_datetime(tech['date'])
     fund['date'] = pd.to_datetime(fund['date'])
 
-    tech = tech.sort_values(['ticker', 'date'])
-    fund = fund.sort_values(['ticker', 'date'])
-
-    frames = []
-    for ticker, t_df in tech.groupby("ticker"):
-        f_df = fund[fund["ticker"] == ticker]
-        if f_df.empty: continue
-
-        t_df = t_df.sort_values("date").reset_index(drop=True)
-        f_df = f_df.sort_values("date").reset_index(drop=True)
-
-        merged = pd.merge_asof(
-            t_df,
-            f_df,
-            on="date",
-            direction="backward"  # latest <= weekly date
-        )
-        frames.append(merged)
-
-    dataset = pd.concat(frames, ignore_index=True)
-    dataset.drop(columns=['ticker_y'], inplace=True)
-    dataset.rename(columns={'ticker_x': 'ticker'}, inplace=True)
+    dataset = asof_join(tech, fund)
     dataset.dropna(inplace=True)
     dataset.reset_index(drop=True, inplace=True)
 
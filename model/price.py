@@ -1,9 +1,15 @@
 import pandas as pd
+import numpy as np
 import os
 import json
+import time
+import shutil
+import hashlib
 import yfinance as yf
+from yfinance.exceptions import YFTzMissingError
 from tqdm import tqdm
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 
 def download_spy_components():
@@ -32,6 +38,79 @@ def download_spy_components():
     print("Saved current snapshot and component changes.")
 
 
+class SP500Membership:
+    """
+    Point-in-time S&P 500 membership built once from the latest snapshot and the
+    change events. Membership only changes on event dates, so the index holds one
+    ticker bitmap per interval between consecutive event dates; a date is mapped to
+    its interval with a binary search. Cumulative counts over the bitmaps answer
+    range queries with two lookups.
+    """
+
+    def __init__(self, latest_snapshot, change_events, latest_snapshot_date="2025-04-20"):
+        self.latest_date = np.datetime64(latest_snapshot_date, "D")
+        tickers = sorted(set(latest_snapshot) | {e["ticker"] for e in change_events})
+        self.tickers = pd.Index(tickers)
+
+        event_dates = np.array([e["date"] for e in change_events], dtype="datetime64[D]")
+        self.dates = np.unique(event_dates)  # interval k starts at dates[k - 1]
+        codes = self.tickers.get_indexer([e["ticker"] for e in change_events])
+
+        # rewind the latest snapshot one event date at a time, newest first; events on the
+        # same date are undone in list order, like the old one-event-at-a-time rewind
+        state = np.zeros(len(tickers), dtype=bool)
+        state[self.tickers.get_indexer(list(latest_snapshot))] = True
+        members = np.empty((len(self.dates) + 1, len(tickers)), dtype=bool)
+        members[-1] = state
+        order = np.argsort(-event_dates.astype(np.int64), kind="stable")
+        slot = np.searchsorted(self.dates, event_dates)
+        i = 0
+        for k in range(len(self.dates) - 1, -1, -1):
+            while i < len(order) and slot[order[i]] == k:
+                e = order[i]
+                if change_events[e]["event"] in ("add", "remove"):
+                    state[codes[e]] = change_events[e]["event"] == "remove"
+                i += 1
+            members[k] = state
+        self.members_by_interval = members
+        self._cumulative = np.vstack([np.zeros(len(tickers), dtype=np.int32), np.cumsum(members, axis=0, dtype=np.int32)])
+
+    @classmethod
+    def from_files(cls, directory="spy", latest_snapshot_date="2025-04-20"):
+        """Load the files written by download_spy_components()."""
+        with open(os.path.join(directory, f"{latest_snapshot_date}-snapshot.json")) as f:
+            latest_snapshot = json.load(f)
+        with open(os.path.join(directory, "changes.json")) as f:
+            change_events = json.load(f)
+        return cls(latest_snapshot, change_events, latest_snapshot_date)
+
+    def _interval(self, dates) -> np.ndarray:
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        if (dates > self.latest_date).any():
+            raise ValueError("Can't move forward in time from a snapshot in the future.")
+        return np.searchsorted(self.dates, dates, side="right")
+
+    def mask(self, dt) -> np.ndarray:
+        """Boolean membership over self.tickers on dt."""
+        return self.members_by_interval[self._interval(dt)]
+
+    def members(self, dt) -> set:
+        """Tickers in the index on dt."""
+        return set(self.tickers[self.mask(dt)])
+
+    def members_between(self, start, end, always=False) -> set:
+        """Tickers in the index at any point of [start, end], or throughout it with always=True."""
+        lo, hi = self._interval([start, end])
+        counts = self._cumulative[hi + 1] - self._cumulative[lo]
+        return set(self.tickers[counts == hi - lo + 1 if always else counts > 0])
+
+    def contains(self, tickers, dates) -> np.ndarray:
+        """Row-wise membership for (ticker, date) arrays, e.g. to filter a weekly dataset."""
+        cols = self.tickers.get_indexer(tickers)
+        rows = self._interval(pd.to_datetime(dates).values)
+        return np.where(cols >= 0, self.members_by_interval[rows, np.maximum(cols, 0)], False)
+
+
 def get_sp500_snapshot(dt, latest_snapshot, change_events, latest_snapshot_date="2025-04-20"):
     """
     Reconstructs S&P500 index membership at a past date by rewinding the latest snapshot
@@ -45,48 +124,38 @@ def get_sp500_snapshot(dt, latest_snapshot, change_events, latest_snapshot_date=
 
     Returns:
     - Set of tickers that were in the index on dt
-    """
-    snapshot = set(latest_snapshot)
-    dt = datetime.strptime(dt, "%Y-%m-%d")
-    latest_snapshot_date = datetime.strptime(latest_snapshot_date, "%Y-%m-%d")
-
-    if dt > latest_snapshot_date:
-        raise ValueError("Can't move forward in time from a snapshot in the future.")
-    
-    for event in sorted(change_events, key=lambda x: x["date"], reverse=True):
-        event_date = datetime.strptime(event["date"], "%Y-%m-%d")
-
-        if event_date > dt:
-            if event["event"] == "add":
-                snapshot.discard(event["ticker"])
-            elif event["event"] == "remove":
-                snapshot.add(event["ticker"])
-        else:
-            break
 
-    return snapshot
+    One-off query; for several dates build an SP500Membership once (e.g. from_files)
+    and query it.
+    """
+    return SP500Membership(latest_snapshot, change_events, latest_snapshot_date).members(dt)
 
 
 def get_all_unique_tickers_since(dt: str, current_tickers: list, change_events: list) -> list:
-    sn = get_sp500_snapshot(dt, current_tickers, change_events)
+    """Tickers in the index on dt or in current_tickers (the latest snapshot)."""
+    sn = SP500Membership(current_tickers, change_events).members(dt)
     return [{'ticker': ticker, 'name': ''} for ticker in sn.union(set(current_tickers))]
 
 
-def load_stooq_prices(symbols, connection):
+def load_stooq_prices(symbols, write):
     '''
+    Read each symbol's Stooq file and hand its rows to write(df), e.g.
+    functools.partial(services.db.store_prices, services.db.connect()).
+
     stock data columns:
     <TICKER>,<PER>,<DATE>,<TIME>,<OPEN>,<HIGH>,<LOW>,<CLOSE>,<VOL>,<OPENINT>
     AA.US,D,19700102,000000,2.27537,2.29565,2.27537,2.27537,26690.902166928,0
     
-    database columns:
+    columns passed to write (the prices table, schema owned by services.db migrations):
     CREATE TABLE "prices" (
-        "date"	TIMESTAMP,
-        "ticker"	TEXT,
+        "date"	TIMESTAMP NOT NULL,
+        "ticker"	TEXT NOT NULL,
         "open"	REAL,
         "high"	REAL,
         "low"	REAL,
         "close"	REAL,
-        "volume"	INTEGER
+        "volume"	INTEGER,
+        UNIQUE ("ticker", "date")
     );
     '''
     for symbol in tqdm(symbols):
@@ -102,32 +171,185 @@ def load_stooq_prices(symbols, connection):
         df.rename(columns={'<TICKER>': 'ticker', '<DATE>': 'date', '<OPEN>': 'open', '<HIGH>': 'high', '<LOW>': 'low', '<CLOSE>': 'close', '<VOL>': 'volume'}, inplace=True)
         df['date'] = pd.to_datetime(df['date'], format='%Y%m%d')
         df['ticker'] = symbol
-        df.to_sql('prices', connection, if_exists='append', index=False)
+        write(df[['date', 'ticker', 'open', 'high', 'low', 'close', 'volume']])
+
 
+class YFinanceSource:
+    """Daily bars from Yahoo Finance, adjusted like yf.download(auto_adjust=True)."""
 
-def download_prices(tickers: list[str], start: str = None, end: str = None, interval: str = '1d') -> pd.DataFrame:
-    ''''
-    Download price data from yfinance.
+    def fetch(self, tickers: list[str], start: str, end: str, interval: str) -> pd.DataFrame:
+        # one batched request per chunk; threads=False as the chunks already run on
+        # download_prices' workers
+        data = yf.download(
+            tickers, start=start, end=end, interval=interval, auto_adjust=True,
+            group_by='ticker', threads=False, progress=False,
+        ) if tickers else pd.DataFrame()
+        frames = []
+        for ticker in tickers:
+            key = ticker.upper()
+            hist = data[key].dropna(how='all') if key in data.columns.get_level_values(0) else data.iloc[:0]
+            if hist.empty:
+                # yf.download logs a failed ticker and leaves it empty; ask for it
+                # alone so a failure raises and the chunk is retried rather than
+                # checkpointed as a ticker without data
+                hist = self._history(ticker, start, end, interval)
+                if hist is None or hist.empty:
+                    continue
+            hist = hist[['Close', 'High', 'Low', 'Open', 'Volume']].rename_axis(index='Date', columns=None).reset_index()
+            hist.insert(1, 'Ticker', ticker)
+            frames.append(hist)
+        if not frames:
+            return pd.DataFrame(columns=['Date', 'Ticker', 'Close', 'High', 'Low', 'Open', 'Volume'])
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def _history(ticker: str, start: str, end: str, interval: str):
+        try:
+            hist = yf.Ticker(ticker).history(
+                start=start, end=end, interval=interval, auto_adjust=True, raise_errors=True
+            )
+        except YFTzMissingError as e:
+            # Yahoo has no such symbol any more (delisted)
+            print(f'{ticker}: {e}')
+            return None
+        hist.index = hist.index.tz_localize(None)
+        return hist
+
+
+class CsvSource:
+    """
+    Offline stand-in serving recorded <ticker>.csv files (Date, Close, High, Low, Open, Volume),
+    e.g. written by record_prices(). `latency` seconds per ticker simulates the network.
+    """
+
+    def __init__(self, directory: str, latency: float = 0.0):
+        self.directory = directory
+        self.latency = latency
+
+    def fetch(self, tickers: list[str], start: str, end: str, interval: str) -> pd.DataFrame:
+        frames = []
+        for ticker in tickers:
+            time.sleep(self.latency)
+            path = os.path.join(self.directory, f'{ticker}.csv')
+            if not os.path.exists(path):
+                continue
+            df = pd.read_csv(path, parse_dates=['Date'])
+            df = df[(df['Date'] >= start) & (df['Date'] < end)]
+            df.insert(1, 'Ticker', ticker)
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame(columns=['Date', 'Ticker', 'Close', 'High', 'Low', 'Open', 'Volume'])
+        return pd.concat(frames, ignore_index=True)
+
+
+def record_prices(df: pd.DataFrame, directory: str):
+    """Write a download_prices() result as per-ticker CSVs for CsvSource."""
+    os.makedirs(directory, exist_ok=True)
+    for ticker, group in df.groupby('ticker'):
+        (
+            group.drop(columns='ticker')
+            .rename(columns=str.capitalize)
+            .to_csv(os.path.join(directory, f'{ticker}.csv'), index=False)
+        )
+
+
+RUN_FILE = 'run.json'
+
+
+def checkpoint_end(checkpoint_dir: str, start: str, interval: str = '1d') -> str:
+    """
+    End date of the checkpointed run for `start`: the one recorded by an unfinished
+    run, so chunks fetched before a crash keep matching when it resumes on a later
+    day, or today, recorded for a later resume.
+    """
+    path = os.path.join(checkpoint_dir, RUN_FILE)
+    try:
+        with open(path) as f:
+            run = json.load(f)
+        if run['start'] == start and run['interval'] == interval:
+            return run['end']
+    except (OSError, ValueError, KeyError):
+        pass
+    end = datetime.now().strftime('%Y-%m-%d')
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'start': start, 'end': end, 'interval': interval}, f)
+    os.replace(path + '.tmp', path)
+    return end
+
+
+def _fetch_chunk(source, tickers, start, end, interval, retries, backoff, checkpoint_dir):
+    path = None
+    if checkpoint_dir is not None:
+        key = hashlib.sha1(json.dumps([tickers, start, end, interval]).encode()).hexdigest()
+        path = os.path.join(checkpoint_dir, f'chunk-{key}.pkl')
+        if os.path.exists(path):
+            return pd.read_pickle(path)
+
+    for attempt in range(retries + 1):
+        try:
+            df = source.fetch(tickers, start, end, interval)
+            break
+        except Exception as e:
+            if attempt == retries:
+                raise
+            wait = backoff * 2 ** attempt
+            print(f'Chunk {tickers[0]}..{tickers[-1]} failed ({e}), retrying in {wait:.1f}s')
+            time.sleep(wait)
+
+    if path is not None:
+        df.to_pickle(path + '.tmp')
+        os.replace(path + '.tmp', path)
+    return df
+
+
+def download_prices(
+    tickers: list[str],
+    start: str = None,
+    end: str = None,
+    interval: str = '1d',
+    source=None,
+    chunk_size: int = 100,
+    workers: int = 4,
+    retries: int = 3,
+    backoff: float = 2.0,
+    checkpoint_dir: str = None,
+) -> pd.DataFrame:
+    '''
+    Download price data, by default from yfinance.
     If start is None, download all available data.
     If end is None, download all available data until now.
+
+    Tickers are fetched in chunks of `chunk_size` on `workers` threads, each chunk
+    retried with exponential backoff. With `checkpoint_dir`, finished chunks are kept
+    on disk so a re-run with the same arguments only fetches what is missing; a
+    default `end` is pinned in the checkpoint directory (checkpoint_end) for that.
     '''
     if start is None:
         start = '2007-01-01'
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
     if end is None:
-        end = datetime.now().strftime('%Y-%m-%d')
-
-    df = yf.download(
-        tickers,
-        start=start,
-        end=end,
-        interval=interval,
-        auto_adjust=True
-    )
-    df = (
-        df
-        .stack(level='Ticker')
-        .rename_axis(index=['Date','Ticker'])
-        .reset_index()
-    ).sort_values(['Ticker', 'Date']).reset_index(drop=True)
+        end = checkpoint_end(checkpoint_dir, start, interval) if checkpoint_dir else datetime.now().strftime('%Y-%m-%d')
+    if source is None:
+        source = YFinanceSource()
+
+    chunks = [tickers[i:i + chunk_size] for i in range(0, len(tickers), chunk_size)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_fetch_chunk, source, chunk, start, end, interval, retries, backoff, checkpoint_dir)
+            for chunk in chunks
+        ]
+        # results in chunk order; any chunk that still fails aborts the download,
+        # the checkpointed ones are reused by the next attempt
+        frames = [f.result() for f in futures]
+
+    df = pd.concat(frames, ignore_index=True) if frames else source.fetch([], start, end, interval)
+    df = df.sort_values(['Ticker', 'Date']).reset_index(drop=True)
     df.columns = [col.lower() for col in df.columns]
     return df
+
+
+def clear_checkpoints(checkpoint_dir: str):
+    if os.path.isdir(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
@@ -0,0 +1,182 @@
+import numpy as np
+
+# Rolling window moments from shared cumulative sums.
+#
+# Every window length is read off the same prefix sums (window sum = S[t] - S[t-n]),
+# so asking for several windows or several statistics of one series costs O(rows)
+# each. Windows follow pandas rolling(n) with min_periods=n: a NaN anywhere in the
+# window gives NaN, and the first n-1 rows are NaN.
+#
+# Numerical stability: each column is shifted by its mean before summing, and the
+# prefix sums are compensated (the rounding error of every running addition is
+# accumulated separately), so a window sum is accurate to its own magnitude rather
+# than to that of the whole history. What remains is cancellation inside a window
+# whose values sit far from the column mean relative to their spread (a trending,
+# high-priced series): var = (sum(d^2) - sum(d)^2 / n) / (n - ddof) loses about
+# log10(sum(d^2) / (n * var)) digits. Windows past CONDITION_LIMIT are recomputed
+# directly, centred on their own mean. Windows whose values are all equal report a
+# variance of exactly 0 (as pandas does) instead of rounding noise.
+
+# recompute a window once its sums cancel by more than this factor (~4 of 16 digits)
+CONDITION_LIMIT = 1e4
+
+
+def _prefix(a: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Compensated cumulative sum along rows with a leading zero row: (sum, error)."""
+    a = np.asarray(a, dtype=float)
+    hi = np.zeros((len(a) + 1,) + a.shape[1:])
+    np.cumsum(a, axis=0, out=hi[1:])
+    # exact rounding error of each running addition hi[i] = hi[i-1] + a[i-1] (TwoSum)
+    prev, cur = hi[:-1], hi[1:]
+    added = cur - prev
+    err = (prev - (cur - added)) + (a - added)
+    lo = np.zeros_like(hi)
+    np.cumsum(err, axis=0, out=lo[1:])
+    return hi, lo
+
+
+def _counts(a: np.ndarray) -> np.ndarray:
+    """Exact cumulative count of True along rows with a leading zero row."""
+    out = np.zeros((len(a) + 1,) + a.shape[1:], dtype=np.int64)
+    np.cumsum(a, axis=0, out=out[1:])
+    return out
+
+
+def _window(prefix, n: int) -> np.ndarray:
+    """Sums over the trailing n rows, NaN for the first n-1 rows."""
+    hi, lo = prefix if isinstance(prefix, tuple) else (prefix, None)
+    out = np.full((len(hi) - 1,) + hi.shape[1:], np.nan)
+    if len(hi) > n:
+        out[n - 1:] = hi[n:] - hi[:-n]
+        if lo is not None:
+            out[n - 1:] += lo[n:] - lo[:-n]
+    return out
+
+
+def _windows(x: np.ndarray, rows: np.ndarray, cols: np.ndarray, n: int) -> np.ndarray:
+    """Values of the n-row windows ending at (rows, cols) of a 2-D x, one window per row."""
+    return x[rows[:, None] - np.arange(n - 1, -1, -1), cols[:, None]]
+
+
+def _patch(out: np.ndarray, mask: np.ndarray, values: np.ndarray):
+    """Write values, in np.nonzero order, to the masked cells of out."""
+    rows, cols = np.nonzero(mask.reshape(len(mask), -1))
+    out.reshape(len(out), -1)[rows, cols] = values
+
+
+class RollingMoments:
+    """
+    Windowed mean, variance, covariance, correlation and linear-regression slope
+    of the columns of x (rows x series, or a single series).
+
+        r = RollingMoments(returns)
+        r.std(13), r.std(26), r.cov(RollingMoments(benchmark), 13)
+    """
+
+    def __init__(self, x: np.ndarray):
+        x = np.asarray(x, dtype=float)
+        self.shape = x.shape
+        self._x = x
+        missing = np.isnan(x)
+        with np.errstate(invalid="ignore"):
+            self._shift = np.nanmean(x, axis=0) if len(x) else np.zeros(x.shape[1:])
+        self._shift = np.nan_to_num(self._shift)
+        self._dev = np.where(missing, 0.0, x - self._shift)
+
+        self._missing = _counts(missing)
+        self._sum = _prefix(self._dev)
+        self._sumsq = _prefix(self._dev * self._dev)
+        # rows that differ from the previous one; a window without any is constant
+        changed = np.ones(x.shape, dtype=bool)
+        changed[1:] = x[1:] != x[:-1]
+        self._changed = _counts(changed)
+        self._products = {}
+        self._sum_tx = None
+
+    def _complete(self, n: int) -> np.ndarray:
+        return _window(self._missing, n) == 0
+
+    def _constant(self, n: int) -> np.ndarray:
+        # no change among the n-1 row pairs inside the window
+        out = np.zeros(self.shape, dtype=bool)
+        if n > 1 and len(self._changed) > n:
+            out[n - 1:] = (self._changed[n:] - self._changed[1:-n + 1]) == 0
+        elif n == 1:
+            out[:] = True
+        return out
+
+    def _centred(self, n: int) -> tuple[np.ndarray, np.ndarray]:
+        """sum((x - window mean)^2) per window, and whether it is too cancelled to trust."""
+        s, ss = _window(self._sum, n), _window(self._sumsq, n)
+        centred = ss - s * s / n
+        with np.errstate(invalid="ignore"):
+            ill = self._complete(n) & ~self._constant(n) & ~(ss <= CONDITION_LIMIT * centred)
+        return centred, ill
+
+    def _recentred(self, ill: np.ndarray, n: int) -> np.ndarray:
+        """The flagged windows, one per row, centred on their own mean."""
+        rows, cols = np.nonzero(ill.reshape(len(ill), -1))
+        w = _windows(self._x.reshape(len(self._x), -1), rows, cols, n)
+        return w - w.mean(axis=1, keepdims=True)
+
+    def sum(self, n: int) -> np.ndarray:
+        return np.where(self._complete(n), _window(self._sum, n) + n * self._shift, np.nan)
+
+    def mean(self, n: int) -> np.ndarray:
+        return np.where(self._complete(n), _window(self._sum, n) / n + self._shift, np.nan)
+
+    def var(self, n: int, ddof: int = 1) -> np.ndarray:
+        centred, ill = self._centred(n)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            var = centred / (n - ddof)
+        if ill.any():
+            d = self._recentred(ill, n)
+            _patch(var, ill, (d * d).sum(axis=1) / (n - ddof))
+        var = np.where(self._constant(n), 0.0, np.maximum(var, 0.0))
+        return np.where(self._complete(n), var, np.nan)
+
+    def std(self, n: int, ddof: int = 1) -> np.ndarray:
+        return np.sqrt(self.var(n, ddof))
+
+    def cov(self, other: "RollingMoments", n: int, ddof: int = 1) -> np.ndarray:
+        key = id(other)
+        if key not in self._products:
+            self._products[key] = (other, _prefix(self._dev * other._dev))
+        sxy = _window(self._products[key][1], n)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = (sxy - _window(self._sum, n) * _window(other._sum, n) / n) / (n - ddof)
+        complete = self._complete(n) & other._complete(n)
+        # cov is read relative to both spreads (corr, beta), so a window is as
+        # ill-conditioned as the worse of the two series
+        ill = complete & (self._centred(n)[1] | other._centred(n)[1])
+        if ill.any():
+            dx, dy = self._recentred(ill, n), other._recentred(ill, n)
+            _patch(cov, ill, (dx * dy).sum(axis=1) / (n - ddof))
+        return np.where(complete, cov, np.nan)
+
+    def corr(self, other: "RollingMoments", n: int) -> np.ndarray:
+        den = np.sqrt(self.var(n) * other.var(n))
+        # NaN rather than +-inf for flat windows, as pandas reports
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(den > 0, self.cov(other, n) / den, np.nan)
+
+    def beta(self, market: "RollingMoments", n: int) -> np.ndarray:
+        """cov(self, market) / var(market), like rolling(n).cov(m) / m.rolling(n).var()."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.cov(market, n) / market.var(n)
+
+    def slope(self, n: int) -> np.ndarray:
+        """Least-squares slope of each window against its row position."""
+        if self._sum_tx is None:
+            t = np.arange(len(self._dev)).reshape((-1,) + (1,) * (self._dev.ndim - 1))
+            self._sum_tx = _prefix(t * self._dev)
+        # sum((t - t_mid) * x) over the window, with t_mid its centre row
+        t_mid = np.arange(len(self._dev)) - (n - 1) / 2
+        t_mid = t_mid.reshape((-1,) + (1,) * (self._dev.ndim - 1))
+        sxy = _window(self._sum_tx, n) - t_mid * _window(self._sum, n)
+        slope = sxy / (n * (n * n - 1) / 12)
+        _, ill = self._centred(n)
+        if ill.any():
+            d = self._recentred(ill, n)
+            _patch(slope, ill, (d @ (np.arange(n) - (n - 1) / 2)) / (n * (n * n - 1) / 12))
+        return np.where(self._complete(n), slope, np.nan)
@@ -1,98 +1,237 @@
+"""
+Walk-forward training of the pickers.
+
+    python -m model.train [--folds 5] [--out model/pickers] [--models dt rf gbm]
+
+Reads the dataset from the feature store (the block the dataset table was built
+from) or the dataset table, falling back to data/dataset.csv. Rows are ordered by
+date and split into walk-forward folds: fold k tests on the k-th of the last
+n_folds date blocks and trains on everything dated before it, minus a purge gap of
+one quarter, since a row's label looks up to a quarter ahead. Every (model, fold)
+fit and the final fits on all rows run in parallel with joblib, reading one cached
+date-ordered feature matrix that is memory-mapped rather than copied to workers.
+
+The final pickers are written to the pickers directory next to a metrics manifest
+(ModelRegistry.metrics) with per-fold and mean out-of-sample scores.
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import numpy as np
 import pandas as pd
 import joblib
-from sklearn.model_selection import train_test_split
+from joblib import Parallel, delayed
 from sklearn.linear_model import LogisticRegression
 from sklearn.svm import SVC, LinearSVC
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
-from sklearn.metrics import accuracy_score
-import os
-
-
-os.makedirs('models', exist_ok=True)
-
-df = pd.read_csv('data/dataset.csv')
-features = [c for c in df.columns if c not in ['ticker', 'date', 'close_raw', 'outperformed', 'quarter_id']]
-
-def apply_partial_dropout(df, k=4):
-    if k == 0:
-        return df
-    return df.groupby('quarter_id').apply(lambda group: group.sample(n=min(k, len(group)))).reset_index(drop=True)
-
-def prepare_model_data(df):
-    df = apply_partial_dropout(df, k=0) # Using k=0 as in the original script
-    X = df[features].values
-    y = df['outperformed'].values
-    return X, y
-
-X, y = prepare_model_data(df)
-print(X.shape)
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2)
-
-def train_model(model, X_train, y_train, X_test, y_test, model_name):
-    """Trains a given model, prints its accuracy, and returns the trained model."""
-    print(f"Training {model_name}...")
-    model.fit(X_train, y_train)
-    y_pred = model.predict(X_test)
-    acc = accuracy_score(y_test, y_pred)
-    print(f"{model_name} Test Accuracy: {acc:.4f}")
-    return model
-
-# --- Model Training Functions ---
-
-def train_log_reg_l1(X_train, y_train, X_test, y_test):
-    # liblinear solver supports L1 penalty
-    model = LogisticRegression(penalty='l1', solver='liblinear')
-    return train_model(model, X_train, y_train, X_test, y_test, "Logistic Regression (L1)")
-
-def train_log_reg_l2(X_train, y_train, X_test, y_test):
-    # liblinear solver supports L1 penalty
-    model = LogisticRegression(penalty='l2', solver='liblinear')
-    return train_model(model, X_train, y_train, X_test, y_test, "Logistic Regression (L2)")
-
-def train_log_reg_en(X_train, y_train, X_test, y_test):
-    model = LogisticRegression(penalty='elasticnet', solver='saga', l1_ratio=0.5, max_iter=1000) # Increased max_iter for saga
-    return train_model(model, X_train, y_train, X_test, y_test, "Logistic Regression (ElasticNet)")
-
-def train_lin_svm(X_train, y_train, X_test, y_test):
-    model = LinearSVC(random_state=42, dual="auto", C=1.0, max_iter=10000) # Increased max_iter
-    return train_model(model, X_train, y_train, X_test, y_test, "Linear SVM")
-
-def train_rbf_svm(X_train, y_train, X_test, y_test):
-    # C is the regularization parameter, gamma is the kernel coefficient
-    model = SVC(kernel='rbf', C=1.0, gamma='scale')
-    return train_model(model, X_train, y_train, X_test, y_test, "RBF SVM")
-
-def train_dt(X_train, y_train, X_test, y_test):
-    model = DecisionTreeClassifier(random_state=42)
-    return train_model(model, X_train, y_train, X_test, y_test, "Decision Tree")
-
-def train_rf(X_train, y_train, X_test, y_test):
-    model = RandomForestClassifier(random_state=42, n_estimators=100) # n_estimators is a common parameter to tune
-    return train_model(model, X_train, y_train, X_test, y_test, "Random Forest")
-
-def train_gbm(X_train, y_train, X_test, y_test):
-    model = GradientBoostingClassifier(random_state=42, n_estimators=100, learning_rate=0.1) # n_estimators and learning_rate are common
-    return train_model(model, X_train, y_train, X_test, y_test, "Gradient Boosted Tree")
-
-# --- Main Training Loop ---
-models_to_train = {
-    # "log_reg_l1": train_log_reg_l1,
-    # "log_reg_en": train_log_reg_en,
-    # "lin_svm": train_lin_svm,
-    # "rbf_svm": train_rbf_svm,
-    "dt": train_dt,
-    "rf": train_rf,
-    "gbm": train_gbm
+from sklearn.metrics import accuracy_score, roc_auc_score
+
+from config import settings
+from services.db import connect
+from services.feature_store import block_key, current_dataset, frame_digest
+from services.optimization import FEATURE_EXCLUDE, SELECT_THRESHOLD, predict_matrix
+from services.registry import METRICS
+
+PURGE_WEEKS = 13
+FOLDS_DIR = "folds"
+
+MODELS = {
+    # "log_reg_l1": lambda: LogisticRegression(penalty='l1', solver='liblinear'),
+    # "log_reg_l2": lambda: LogisticRegression(penalty='l2', solver='liblinear'),
+    # "log_reg_en": lambda: LogisticRegression(penalty='elasticnet', solver='saga', l1_ratio=0.5, max_iter=1000),
+    # "lin_svm": lambda: LinearSVC(random_state=42, dual="auto", C=1.0, max_iter=10000),
+    # "rbf_svm": lambda: SVC(kernel='rbf', C=1.0, gamma='scale'),
+    "dt": lambda: DecisionTreeClassifier(random_state=42),
+    # one job per fit: the folds already run in parallel
+    "rf": lambda: RandomForestClassifier(random_state=42, n_estimators=100, n_jobs=1),
+    "gbm": lambda: GradientBoostingClassifier(random_state=42, n_estimators=100, learning_rate=0.1),
 }
 
-trained_models = {}
-
-for model_name, training_function in models_to_train.items():
-    model = training_function(X_train, y_train, X_test, y_test)
-    trained_models[model_name] = model
-    model_path = f'models/{model_name}.pkl'
-    joblib.dump(model, model_path)
-    print(f"Saved {model_name} to {model_path}\n")
 
-print("All models trained and saved.")
+def load_dataset() -> pd.DataFrame:
+    """Labelled dataset rows, ordered by date (ticker order kept within a date)."""
+    df = None
+    # connect() would create (and migrate) an empty DB file where there is none
+    if os.path.exists(settings.DB_PATH):
+        con = connect()
+        try:
+            df = current_dataset(con)
+            if df is None:
+                df = pd.read_sql("SELECT * FROM dataset", con, parse_dates=["date"])
+        except pd.errors.DatabaseError:
+            pass
+        finally:
+            con.close()
+    if df is None:
+        df = pd.read_csv('data/dataset.csv', parse_dates=["date"])
+    df = df.dropna()
+    return df.sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def walk_forward_folds(dates: pd.Series, n_folds: int, purge_weeks: int = PURGE_WEEKS) -> list[dict]:
+    """
+    Row ranges of each fold over date-ordered rows: train [0, train_end) and test
+    [test_start, test_end). Test blocks split the later dates into n_folds equal
+    date spans after an initial training block of the same length.
+    """
+    dates = dates.to_numpy()
+    unique = np.unique(dates)
+    edges = np.linspace(0, len(unique), n_folds + 2).astype(int)[1:]
+    folds = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        test_first = unique[start]
+        train_end = np.searchsorted(dates, test_first - np.timedelta64(7 * purge_weeks, "D"), side="left")
+        if train_end == 0:
+            continue
+        folds.append({
+            "train_end": int(train_end),
+            "test_start": int(np.searchsorted(dates, test_first, side="left")),
+            "test_end": int(np.searchsorted(dates, unique[end - 1], side="right")),
+            "test_dates": [str(pd.Timestamp(test_first).date()), str(pd.Timestamp(unique[end - 1]).date())],
+        })
+    return folds
+
+
+def fold_matrices(df: pd.DataFrame, features: list[str], n_folds: int) -> tuple[np.ndarray, np.ndarray, list[dict], str]:
+    """
+    X, y (memory-mapped) and folds for df, cached under FEATURE_STORE_DIR/folds by
+    a hash of the dataset and fold parameters, so a retrain on unchanged data skips
+    building them. Each fold is a pair of row slices of the same matrices.
+    """
+    key = block_key(dataset=frame_digest(df), features=features, folds=n_folds, purge_weeks=PURGE_WEEKS)
+    root = os.path.join(settings.FEATURE_STORE_DIR, FOLDS_DIR)
+    path = os.path.join(root, key)
+    if not os.path.exists(os.path.join(path, "folds.json")):
+        tmp = f"{path}.tmp{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "X.npy"), df[features].to_numpy(dtype=np.float64))
+        np.save(os.path.join(tmp, "y.npy"), df["outperformed"].to_numpy(dtype=np.int64))
+        with open(os.path.join(tmp, "folds.json"), "w") as f:
+            json.dump(walk_forward_folds(df["date"], n_folds), f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+        # only the latest dataset's folds are worth keeping
+        for e in os.listdir(root):
+            if e != key:
+                shutil.rmtree(os.path.join(root, e), ignore_errors=True)
+    else:
+        print(f"Reusing cached fold matrices {key}")
+
+    with open(os.path.join(path, "folds.json")) as f:
+        folds = json.load(f)
+    X = np.load(os.path.join(path, "X.npy"), mmap_mode="r")
+    y = np.load(os.path.join(path, "y.npy"), mmap_mode="r")
+    return X, y, folds, key
+
+
+def evaluate(model, X: np.ndarray, y: np.ndarray) -> dict:
+    """Out-of-sample scores, including the precision of what select_tickers would pick."""
+    proba = predict_matrix(X, model)
+    selected = proba > SELECT_THRESHOLD
+    return {
+        "rows": int(len(y)),
+        "accuracy": float(accuracy_score(y, model.predict(X))),
+        "roc_auc": float(roc_auc_score(y, proba)) if len(np.unique(y)) == 2 else None,
+        "selected_rate": float(selected.mean()),
+        "selected_precision": float(y[selected].mean()) if selected.any() else None,
+    }
+
+
+def fit(name: str, X: np.ndarray, y: np.ndarray) -> tuple:
+    """Final model on all rows, and its fit time."""
+    t0 = time.perf_counter()
+    model = MODELS[name]().fit(X, y)
+    return model, round(time.perf_counter() - t0, 2)
+
+
+def fit_fold(name: str, X: np.ndarray, y: np.ndarray, fold: dict) -> dict:
+    """Fit on a fold's train rows and score its test rows."""
+    t0 = time.perf_counter()
+    model = MODELS[name]().fit(X[:fold["train_end"]], y[:fold["train_end"]])
+    test = slice(fold["test_start"], fold["test_end"])
+    return {
+        "test_dates": fold["test_dates"],
+        **evaluate(model, X[test], y[test]),
+        "fit_seconds": round(time.perf_counter() - t0, 2),
+    }
+
+
+def _mean(folds: list[dict]) -> dict:
+    keys = ["accuracy", "roc_auc", "selected_rate", "selected_precision"]
+    return {k: float(np.mean(v)) if (v := [f[k] for f in folds if f[k] is not None]) else None for k in keys}
+
+
+def train(models: list[str], n_folds: int = 5, out_dir: str = None, n_jobs: int = None) -> dict:
+    out_dir = out_dir or settings.ML_PICKERS_DIR
+    os.makedirs(out_dir, exist_ok=True)
+    t0 = time.perf_counter()
+
+    df = load_dataset()
+    features = [c for c in df.columns if c not in FEATURE_EXCLUDE]
+    X, y, folds, key = fold_matrices(df, features, n_folds)
+    print(f"{X.shape[0]} rows x {X.shape[1]} features, {len(folds)} walk-forward folds")
+
+    # the final fits on all rows go first: they are the longest
+    jobs = [(name, None) for name in models] + [(name, i) for i in range(len(folds)) for name in models]
+    results = Parallel(n_jobs=n_jobs or settings.TRAIN_WORKERS, verbose=5)(
+        delayed(fit)(name, X, y) if i is None else delayed(fit_fold)(name, X, y, folds[i])
+        for name, i in jobs
+    )
+    results = dict(zip(jobs, results))
+
+    manifest = {
+        "trained_at": pd.Timestamp.now().isoformat(),
+        "dataset": {
+            "key": key,
+            "rows": int(X.shape[0]),
+            "first_date": str(df["date"].min().date()),
+            "last_date": str(df["date"].max().date()),
+        },
+        "features": features,
+        "purge_weeks": PURGE_WEEKS,
+        "models": {},
+    }
+    for name in models:
+        model, seconds = results[(name, None)]
+        fold_scores = [results[(name, i)] for i in range(len(folds))]
+
+        model_path = os.path.join(out_dir, f"{name}.pkl")
+        # write aside and rename: the API memory-maps loaded pickers, so never rewrite one in place
+        joblib.dump(model, model_path + '.tmp')
+        os.replace(model_path + '.tmp', model_path)
+        manifest["models"][name] = {
+            "file": os.path.basename(model_path),
+            "dataset": key,
+            "params": {k: str(v) for k, v in model.get_params().items()},
+            "fit_seconds": seconds,
+            "mean": _mean(fold_scores),
+            "folds": fold_scores,
+        }
+        print(f"Saved {name} to {model_path}: {manifest['models'][name]['mean']}")
+
+    # merged into the existing manifest, so training a subset keeps the other pickers' scores
+    path = os.path.join(out_dir, METRICS)
+    try:
+        with open(path) as f:
+            manifest["models"] = {**json.load(f).get("models", {}), **manifest["models"]}
+    except (OSError, ValueError):
+        pass
+    with open(path + '.tmp', "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+    print(f"Trained {len(models)} models in {time.perf_counter() - t0:.1f}s")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--models", nargs="+", default=list(MODELS), choices=list(MODELS))
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--out", default=settings.ML_PICKERS_DIR)
+    parser.add_argument("--jobs", type=int, default=None)
+    args = parser.parse_args()
+    train(args.models, args.folds, args.out, args.jobs)
@@ -16,19 +16,12 @@ def generate_chart_data(
     tickers_info: dict of ticker metadata (must include 'sector').
     """
     tickers = [s["ticker"] for s in stocks]
-    prices = PricesCache.get_prices()
-    prices = prices[prices["ticker"].isin(tickers)]
-    # prices = prices[prices["date"] <= pd.to_datetime(end_date)]
-    most_recent_ipo_date = prices.sort_values(["ticker", "date"]).groupby("ticker").head(1)['date'].max()
-    prices = prices[prices["date"] >= most_recent_ipo_date]
-
-    price_df = (
-        prices[prices["ticker"].isin(tickers)]
-        .pivot(index="date", columns="ticker", values="price")
-        .sort_index()
-    )
+    price_df = PricesCache.matrix(tickers)
+    # price_df = PricesCache.matrix(tickers, end=end_date)
     if price_df.empty:
         raise ValueError("No price data available for given tickers and date range.")
+    most_recent_ipo_date = price_df.apply(pd.Series.first_valid_index).max()
+    price_df = price_df.loc[most_recent_ipo_date:]
 
     weights = {s["ticker"]: s["weight"] for s in stocks}
     norm = price_df.div(price_df.iloc[0])
@@ -0,0 +1,71 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Columnar on-disk frames: one .npy file per column, strings stored as int32 codes
+# with their categories in the returned entries, read back memory-mapped.
+
+
+def write_columns(path: str, df: pd.DataFrame) -> list[dict]:
+    os.makedirs(path)
+    cols = []
+    for i, (name, s) in enumerate(df.items()):
+        entry = {"name": name, "file": f"c{i}.npy"}
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            values = s.cat.codes.to_numpy().astype(np.int32)
+            entry["categories"] = s.cat.categories.tolist()
+            entry["categorical"] = True
+        elif pd.api.types.is_string_dtype(s.dtype):
+            codes, categories = pd.factorize(s, sort=True)
+            values = codes.astype(np.int32)
+            entry["categories"] = categories.tolist()
+        else:
+            values = s.to_numpy()
+        np.save(os.path.join(path, entry["file"]), values)
+        cols.append(entry)
+    return cols
+
+
+def mmap_array(path: str) -> np.ndarray:
+    # plain read-only ndarray view over the mapping, so derived arrays are not memmaps
+    return np.load(path, mmap_mode="r").view(np.ndarray)
+
+
+def readonly(values: np.ndarray) -> np.ndarray:
+    """View of values that rejects writes."""
+    if values.flags.writeable:
+        values = values.view()
+        values.flags.writeable = False
+    return values
+
+
+def readonly_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Frame over the same column buffers, numeric ones flagged read-only, so an in-place
+    write through the frame or any shallow copy of it raises instead of changing the
+    data. Object and extension (categorical) columns are kept as they are: pandas'
+    Cython routines need writable object buffers even to read them.
+    """
+    data = {}
+    for name, s in df.items():
+        if isinstance(s.dtype, pd.api.extensions.ExtensionDtype):
+            data[name] = s.array
+        elif s.dtype == object:
+            data[name] = s.to_numpy()
+        else:
+            data[name] = readonly(s.to_numpy())
+    return pd.DataFrame(data, index=df.index, copy=False)
+
+
+def read_columns(path: str, cols: list[dict]) -> pd.DataFrame:
+    data = {}
+    for entry in cols:
+        values = mmap_array(os.path.join(path, entry["file"]))
+        if entry.get("categorical"):
+            values = pd.Categorical.from_codes(values, entry["categories"])
+        elif "categories" in entry:
+            # code -1 (missing) picks the trailing None
+            values = np.asarray(entry["categories"] + [None], dtype=object)[values]
+        data[entry["name"]] = values
+    # copy=False keeps one block per column backed by the memory-mapped file
+    return pd.DataFrame(data, copy=False)
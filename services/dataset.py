@@ -1,44 +1,389 @@
+import os
+import json
+import shutil
 import sqlite3
+import time
+import threading
+import numpy as np
 import pandas as pd
 
 from config import settings
+from services.db import connect
+from services.columns import write_columns, read_columns, mmap_array, readonly, readonly_frame
+from services.feature_store import current_dataset
 
-class PricesCache:
-    _prices: pd.DataFrame = None
-    _dataset: pd.DataFrame = None
+MANIFEST = "manifest.json"
+EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def _days(values) -> np.ndarray:
+    """int32 day offsets from the epoch, as stored by the compact mode."""
+    return (np.asarray(values, dtype="datetime64[D]") - EPOCH).astype(np.int32)
+
+
+def _compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    out = {}
+    for name, s in df.items():
+        if name == "ticker":
+            s = s.astype("category")
+        elif name == "date":
+            s = _days(s.to_numpy())
+        elif name.endswith("_na"):
+            # rows before a ticker's first fundamentals get no flags from the as-of
+            # join; their fundamentals are missing, so they are flagged as such
+            s = s.fillna(1).astype(np.uint8)
+        elif s.dtype == np.float64:
+            s = s.astype(np.float32)
+        elif pd.api.types.is_integer_dtype(s.dtype):
+            s = s.astype(np.int32)
+        out[name] = s
+    return pd.DataFrame(out)
+
+
+class Snapshot:
+    """
+    Immutable view of the loaded price and dataset tables.
+    Accessors return shallow frames over the cached buffers, which are flagged
+    read-only: masking and slicing never copy the whole table, and an in-place
+    write raises, so callers that modify a frame copy it first.
+    Prices are also kept as a wide date x ticker matrix for as-of slicing.
+    `version` is the data version of the on-disk snapshot it was read from.
+
+    In compact storage tickers are categorical, dates are int32 day offsets,
+    features and prices are float32 and `_na` flags uint8; use dataset_until()
+    and matrix() to query either layout by date.
+
+    The dataset is sorted by (ticker, date); latest_quarter_rows() keeps a lazily
+    built index of each ticker's quarter runs for as-of lookups.
+    """
+
+    def __init__(self, prices: pd.DataFrame, dataset: pd.DataFrame, values: np.ndarray, dates: np.ndarray, tickers: list[str], version: int = 0):
+        self.version = version
+        self._prices = readonly_frame(prices)
+        self._dataset = readonly_frame(dataset)
+        self._values = readonly(values)
+        self._dates = readonly(dates)
+        self._columns = {t: i for i, t in enumerate(tickers)}
+        self._quarters = None
 
     @classmethod
-    def load(cls):
-        # read prices directly from the SQLite 'prices' table
-        con = sqlite3.connect(settings.DB_PATH)
-        prices = pd.read_sql(
-            "SELECT date, ticker, close as price FROM prices",
-            con,
-            parse_dates=["date"]
+    def from_frames(cls, prices: pd.DataFrame, dataset: pd.DataFrame) -> "Snapshot":
+        wide = prices.pivot(index="date", columns="ticker", values="price").sort_index()
+        return cls(prices, dataset, wide.to_numpy(), wide.index.values, wide.columns.tolist())
+
+    def compact(self) -> "Snapshot":
+        return Snapshot(
+            _compact_frame(self._prices),
+            _compact_frame(self._dataset),
+            self._values.astype(np.float32),
+            self._dates,
+            list(self._columns),
+            version=self.version,
+        )
+
+    def nbytes(self) -> int:
+        return int(
+            self._prices.memory_usage(deep=True).sum()
+            + self._dataset.memory_usage(deep=True).sum()
+            + self._values.nbytes + self._dates.nbytes
         )
+
+    def last_date(self) -> pd.Timestamp | None:
+        """Most recent price date in the snapshot."""
+        return pd.Timestamp(self._dates[-1]) if len(self._dates) else None
+
+    def prices(self) -> pd.DataFrame:
+        return self._prices.copy(deep=False)
+
+    def dataset(self) -> pd.DataFrame:
+        return self._dataset.copy(deep=False)
+
+    def rows_until(self, end) -> np.ndarray:
+        """Boolean mask of the dataset rows dated on or before `end`."""
+        dates = self._dataset["date"].to_numpy()
+        if dates.dtype == np.int32:
+            return dates <= _days(pd.Timestamp(end).to_datetime64())
+        return dates <= pd.Timestamp(end).to_datetime64()
+
+    def dataset_until(self, end) -> pd.DataFrame:
+        """Dataset rows dated on or before `end`."""
+        return self._dataset[self.rows_until(end)]
+
+    def _quarter_index(self):
+        if self._quarters is None:
+            ds = self._dataset
+            n = len(ds)
+            tickers = ds["ticker"].to_numpy()
+            ticker_start = np.r_[True, tickers[1:] != tickers[:-1]] if n else np.zeros(0, dtype=bool)
+            segment = np.cumsum(ticker_start) - 1
+
+            dates = ds["date"].to_numpy()
+            days = (dates if dates.dtype == np.int32 else _days(dates)).astype(np.int64)
+            first_day = days.min() if n else 0
+            # one sortable key per row: ticker segment in the high bits, day in the low ones
+            key = (segment.astype(np.int64) << 32) + (days - first_day)
+
+            # quarter_id only grows along a ticker's rows, so each quarter is one run
+            quarter = ds["quarter_id"].to_numpy(dtype=float)
+            run_start = ticker_start.copy()
+            run_start[1:] |= quarter[1:] != quarter[:-1]
+            run_start = np.maximum.accumulate(np.where(run_start, np.arange(n), 0))
+            self._quarters = (key, np.flatnonzero(ticker_start), run_start, quarter, first_day)
+        return self._quarters
+
+    def latest_quarter_rows(self, end) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Row positions of each ticker's latest quarter as of `end` (rows dated on or
+        before it), i.e. the rows select_tickers averages over in dataset_until(end).
+        Returns (rows, starts): rows grouped by ticker in dataset order, and the
+        offset of each ticker's block in rows. One binary search per ticker.
+        """
+        key, segment_start, run_start, quarter, first_day = self._quarter_index()
+        end_day = int(_days(pd.Timestamp(end).to_datetime64())) - first_day
+        end_day = min(max(end_day, -1), 2 ** 32 - 1)
+        probes = (np.arange(len(segment_start), dtype=np.int64) << 32) + end_day
+        last = np.searchsorted(key, probes, side="right") - 1
+        last = last[last >= segment_start]
+        last = last[~np.isnan(quarter[last])]
+
+        first = run_start[last]
+        lengths = last - first + 1
+        starts = np.r_[0, np.cumsum(lengths)[:-1]].astype(np.int64)
+        rows = np.arange(lengths.sum()) + np.repeat(first - starts, lengths)
+        return rows, starts
+
+    def matrix(self, tickers: list[str], start=None, end=None) -> pd.DataFrame:
+        """
+        Wide price block for `tickers` (in the given order, unknown ones skipped)
+        between start and end inclusive. Dates where none of the tickers traded
+        are dropped, same as pivoting the filtered long table.
+        """
+        names = [t for t in tickers if t in self._columns]
+        cols = [self._columns[t] for t in names]
+
+        lo = 0 if start is None else np.searchsorted(self._dates, np.datetime64(pd.Timestamp(start)), "left")
+        hi = len(self._dates) if end is None else np.searchsorted(self._dates, np.datetime64(pd.Timestamp(end)), "right")
+
+        block = pd.DataFrame(
+            self._values[lo:hi, cols].astype(np.float64, copy=False),
+            index=pd.DatetimeIndex(self._dates[lo:hi], name="date"),
+            columns=pd.Index(names, name="ticker"),
+        )
+        return block.dropna(how="all")
+
+
+# ---------- on-disk snapshot ---------- #
+# SNAPSHOT_DIR/manifest.json points at the current SNAPSHOT_DIR/<version>/ folder,
+# which holds one .npy file per column (strings stored as int32 codes) plus the
+# wide price matrix. The manifest is swapped with os.replace, so readers never
+# see a half-written snapshot.
+
+def _stamp(con: sqlite3.Connection) -> dict:
+    """What the snapshot was built from; a mismatch with the DB marks it stale."""
+    rows = con.execute("SELECT data, datetime FROM last_updated").fetchall()
+    return {
+        "last_updated": {str(k): str(v) for k, v in rows},
+        "excluded": sorted(settings.EXCLUDED_TICKERS),
+        "storage": settings.PRICES_STORAGE,
+    }
+
+
+def _read_manifest() -> dict | None:
+    try:
+        with open(os.path.join(settings.SNAPSHOT_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(snapshot: Snapshot, stamp: dict) -> dict:
+    """Persist a snapshot as a new version and point the manifest at it."""
+    previous = _read_manifest()
+    versions = [int(e) for e in os.listdir(settings.SNAPSHOT_DIR) if e.isdigit()]
+    version = max(versions + [previous["version"] if previous else 0]) + 1
+    path = os.path.join(settings.SNAPSHOT_DIR, str(version))
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+    manifest = {
+        "version": version,
+        "stamp": stamp,
+        "prices": write_columns(os.path.join(path, "prices"), snapshot._prices),
+        "dataset": write_columns(os.path.join(path, "dataset"), snapshot._dataset),
+        "tickers": list(snapshot._columns),
+    }
+    np.save(os.path.join(path, "values.npy"), snapshot._values)
+    np.save(os.path.join(path, "dates.npy"), snapshot._dates)
+
+    tmp = os.path.join(settings.SNAPSHOT_DIR, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(settings.SNAPSHOT_DIR, MANIFEST))
+
+    # keep the previous version around for readers that still map it
+    keep = {str(version), str(version - 1)}
+    for entry in os.listdir(settings.SNAPSHOT_DIR):
+        if entry.isdigit() and entry not in keep:
+            shutil.rmtree(os.path.join(settings.SNAPSHOT_DIR, entry), ignore_errors=True)
+    return manifest
+
+
+def read_snapshot(manifest: dict) -> Snapshot:
+    path = os.path.join(settings.SNAPSHOT_DIR, str(manifest["version"]))
+    return Snapshot(
+        read_columns(os.path.join(path, "prices"), manifest["prices"]),
+        read_columns(os.path.join(path, "dataset"), manifest["dataset"]),
+        mmap_array(os.path.join(path, "values.npy")),
+        mmap_array(os.path.join(path, "dates.npy")),
+        manifest["tickers"],
+        version=manifest["version"],
+    )
+
+
+def _read_sqlite(con: sqlite3.Connection) -> Snapshot:
+    prices = pd.read_sql(
+        "SELECT date, ticker, close as price FROM prices",
+        con,
+        parse_dates=["date"]
+    )
+    # the feature block the dataset table was written from, if it still matches
+    dataset = current_dataset(con)
+    if dataset is None:
         dataset = pd.read_sql(
             "SELECT * FROM dataset",
             con,
             parse_dates=["date"]
         )
-        con.close()
 
-        # drop excluded tickers
-        prices = prices[~prices["ticker"].isin(settings.EXCLUDED_TICKERS)]
-        dataset = dataset[~dataset["ticker"].isin(settings.EXCLUDED_TICKERS)]
+    # drop excluded tickers
+    prices = prices[~prices["ticker"].isin(settings.EXCLUDED_TICKERS)]
+    dataset = dataset[~dataset["ticker"].isin(settings.EXCLUDED_TICKERS)]
+
+    snapshot = Snapshot.from_frames(
+        prices.sort_values(["ticker","date"]).reset_index(drop=True),
+        dataset.sort_values(["ticker","date"]).reset_index(drop=True),
+    )
+    if settings.PRICES_STORAGE == "compact":
+        snapshot = snapshot.compact()
+    return snapshot
+
+
+def export_snapshot() -> dict:
+    """Rebuild the on-disk snapshot from SQLite; called after every data update."""
+    con = connect()
+    stamp = _stamp(con)
+    snapshot = _read_sqlite(con)
+    con.close()
+    os.makedirs(settings.SNAPSHOT_DIR, exist_ok=True)
+    return write_snapshot(snapshot, stamp)
+
+
+def ensure_snapshot() -> dict:
+    """Export a new on-disk snapshot unless the current one matches the DB; returns its manifest."""
+    con = connect()
+    stamp = _stamp(con)
+    con.close()
 
-        # store a copy in memory
-        cls._prices = prices.sort_values(["ticker","date"]).reset_index(drop=True)
-        cls._dataset = dataset.sort_values(["ticker","date"]).reset_index(drop=True)
+    manifest = _read_manifest()
+    if manifest is None or manifest["stamp"] != stamp:
+        manifest = export_snapshot()
+    return manifest
+
+
+def _current_snapshot(after_version: int = 0) -> Snapshot | None:
+    """Memory-map the on-disk snapshot if it is newer than `after_version`."""
+    if settings.PRICES_ATTACH:
+        # workers only map what the loader process published, they never export
+        manifest = _read_manifest()
+        if manifest is None:
+            raise RuntimeError(f"No snapshot published in {settings.SNAPSHOT_DIR}")
+    else:
+        # SQLite is only read when the snapshot is missing or stale
+        manifest = ensure_snapshot()
+    if manifest["version"] <= after_version:
+        return None
+    return read_snapshot(manifest)
+
+
+class PricesCache:
+    """
+    Process-wide holder of the current Snapshot. Reloads build the new snapshot
+    aside and publish it with a single reference swap, so requests that already
+    took a snapshot finish on the old version.
+    With PRICES_ATTACH set (uvicorn workers) the cache only attaches to the
+    snapshot published by the loader process and polls it for new versions.
+    """
+    _snapshot: Snapshot = None
+    _reload_lock = threading.Lock()
+    _listeners: list = []
 
     @classmethod
-    def get_prices(cls) -> pd.DataFrame:
-        if cls._prices is None:
+    def on_publish(cls, fn):
+        """Call fn(snapshot) in a background thread whenever a new version is served."""
+        cls._listeners.append(fn)
+
+    @classmethod
+    def load(cls):
+        with cls._reload_lock:
+            cls._publish(_current_snapshot())
+
+    @classmethod
+    def reload(cls):
+        """Pick up a newer on-disk snapshot; no-op until the cache is loaded."""
+        if cls._snapshot is None:
+            return
+        with cls._reload_lock:
+            cls._publish(_current_snapshot(cls._snapshot.version))
+
+    @classmethod
+    def watch(cls, interval: float):
+        """Poll for newly published snapshots every `interval` seconds."""
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    cls.reload()
+                except Exception as e:
+                    print(f"PricesCache: reload failed: {e}")
+        threading.Thread(target=poll, daemon=True).start()
+
+    @classmethod
+    def _publish(cls, snapshot: Snapshot | None):
+        # versions only move forward
+        if snapshot is None:
+            return
+        if cls._snapshot is None or snapshot.version > cls._snapshot.version:
+            cls._snapshot = snapshot
+            print(
+                f"PricesCache: serving data version {snapshot.version} "
+                f"({settings.PRICES_STORAGE}, {snapshot.nbytes() / 1024 ** 2:.1f} MB)"
+            )
+            for fn in cls._listeners:
+                threading.Thread(target=fn, args=(snapshot,), daemon=True).start()
+
+    @classmethod
+    def loaded(cls) -> bool:
+        return cls._snapshot is not None
+
+    @classmethod
+    def snapshot(cls) -> Snapshot:
+        snapshot = cls._snapshot
+        if snapshot is None:
             raise RuntimeError("PricesCache not initialized")
-        return cls._prices.copy()
-    
+        return snapshot
+
+    @classmethod
+    def version(cls) -> int:
+        return cls.snapshot().version
+
+    @classmethod
+    def get_prices(cls) -> pd.DataFrame:
+        return cls.snapshot().prices()
+
     @classmethod
     def get_dataset(cls) -> pd.DataFrame:
-        if cls._dataset is None:
-            raise RuntimeError("PricesCache not initialized")
-        return cls._dataset.copy()
+        return cls.snapshot().dataset()
+
+    @classmethod
+    def matrix(cls, tickers: list[str], start=None, end=None) -> pd.DataFrame:
+        return cls.snapshot().matrix(tickers, start=start, end=end)
@@ -0,0 +1,183 @@
+import json
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+
+from config import settings
+
+BATCH_SIZE = 10_000
+
+
+@contextmanager
+def transaction(con: sqlite3.Connection):
+    """Explicit BEGIN/COMMIT, so DDL and DML land in the same transaction."""
+    con.execute("BEGIN")
+    try:
+        yield con
+    except Exception:
+        con.rollback()
+        raise
+    con.commit()
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+    """Open the data DB in WAL mode with the schema migrated to the latest version."""
+    con = sqlite3.connect(path or settings.DB_PATH)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    migrate(con)
+    return con
+
+
+# ---------- migrations ---------- #
+# Each migration runs once, in order, tracked by PRAGMA user_version.
+
+def _table_columns(con: sqlite3.Connection, name: str) -> list[str]:
+    return [row[1] for row in con.execute(f'PRAGMA table_info("{name}")')]
+
+
+def _recreate(con: sqlite3.Connection, name: str, ddl: str):
+    """Create `name` from ddl, copying rows (first of any duplicate key wins) from an existing table."""
+    old = _table_columns(con, name)
+    con.execute(ddl.format(name=f"{name}_new"))
+    if old:
+        cols = ", ".join(f'"{c}"' for c in _table_columns(con, f"{name}_new") if c in old)
+        con.execute(f'INSERT OR IGNORE INTO "{name}_new" ({cols}) SELECT {cols} FROM "{name}" ORDER BY rowid')
+        con.execute(f'DROP TABLE "{name}"')
+    con.execute(f'ALTER TABLE "{name}_new" RENAME TO "{name}"')
+
+
+def _prices(con: sqlite3.Connection):
+    _recreate(con, "prices", """
+        CREATE TABLE {name} (
+            date    TIMESTAMP NOT NULL,
+            ticker  TEXT NOT NULL,
+            open    REAL,
+            high    REAL,
+            low     REAL,
+            close   REAL,
+            volume  INTEGER,
+            UNIQUE (ticker, date)
+        )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS ix_prices_date ON prices (date)")
+
+
+def _spy(con: sqlite3.Connection):
+    _recreate(con, "spy", """
+        CREATE TABLE {name} (
+            date    TIMESTAMP NOT NULL UNIQUE,
+            open    REAL,
+            high    REAL,
+            low     REAL,
+            close   REAL,
+            volume  INTEGER
+        )
+    """)
+
+
+def _bookkeeping(con: sqlite3.Connection):
+    con.execute("CREATE TABLE IF NOT EXISTS last_updated (data TEXT, datetime TIMESTAMP)")
+    con.execute("""
+        CREATE TABLE ticker_updates (
+            ticker      TEXT PRIMARY KEY,
+            last_date   TIMESTAMP,
+            updated_at  TIMESTAMP
+        )
+    """)
+    con.execute(
+        "INSERT INTO ticker_updates SELECT ticker, MAX(date), ? FROM prices GROUP BY ticker",
+        (datetime.now().isoformat(),)
+    )
+
+
+def _dataset_index(con: sqlite3.Connection):
+    if _table_columns(con, "dataset"):
+        # first of any duplicate key wins, as in _recreate
+        con.execute("DELETE FROM dataset WHERE rowid NOT IN (SELECT MIN(rowid) FROM dataset GROUP BY ticker, date)")
+        con.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_dataset_key ON dataset (ticker, date)")
+
+
+MIGRATIONS = [_prices, _spy, _bookkeeping, _dataset_index]
+
+
+def migrate(con: sqlite3.Connection):
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    for i, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        with transaction(con):
+            step(con)
+            con.execute(f"PRAGMA user_version = {i}")
+        print(f"Migrated data DB to schema version {i}")
+
+
+# ---------- writers ---------- #
+
+def insert_rows(con: sqlite3.Connection, table: str, df: pd.DataFrame, columns: list[str]) -> int:
+    """
+    INSERT OR IGNORE df[columns] into table in batches; rows whose unique key already
+    exists are kept. Does not commit, so callers can group writes into one transaction.
+    """
+    if df.empty:
+        return 0
+    df = df[columns].copy()
+    if "date" in columns:
+        dates = pd.to_datetime(df["date"])
+        if dates.dt.tz is not None:
+            dates = dates.dt.tz_localize(None)
+        # same text format pandas.to_sql used for the existing rows, so the unique index matches
+        df["date"] = dates.dt.strftime("%Y-%m-%d %H:%M:%S")
+    rows = df.astype(object).where(df.notna(), None).values.tolist()
+
+    names = ", ".join(f'"{c}"' for c in columns)
+    sql = f'INSERT OR IGNORE INTO "{table}" ({names}) VALUES ({", ".join("?" * len(columns))})'
+    inserted = 0
+    for i in range(0, len(rows), BATCH_SIZE):
+        cur = con.executemany(sql, rows[i:i + BATCH_SIZE])
+        inserted += cur.rowcount
+    return inserted
+
+
+def _sql_type(dtype) -> str:
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def write_table(con: sqlite3.Connection, table: str, df: pd.DataFrame, key: list[str]):
+    """
+    Replace a derived table (dataset, feature_moments) in one transaction, recreating
+    it with typed columns and a unique index on `key` instead of to_sql(replace).
+    """
+    cols = ", ".join(f'"{c}" {_sql_type(df[c].dtype)}' for c in df.columns)
+    key_cols = ", ".join(f'"{c}"' for c in key)
+    with transaction(con):
+        con.execute(f'DROP TABLE IF EXISTS "{table}"')
+        con.execute(f'CREATE TABLE "{table}" ({cols})')
+        con.execute(f'CREATE UNIQUE INDEX "ux_{table}_key" ON "{table}" ({key_cols})')
+        insert_rows(con, table, df, list(df.columns))
+
+
+def touch_tickers(con: sqlite3.Connection, tickers: list[str]):
+    """Record the latest stored price date per ticker. Does not commit."""
+    con.execute(
+        """
+        INSERT OR REPLACE INTO ticker_updates (ticker, last_date, updated_at)
+        SELECT ticker, MAX(date), ? FROM prices
+        WHERE ticker IN (SELECT value FROM json_each(?))
+        GROUP BY ticker
+        """,
+        (datetime.now().isoformat(), json.dumps(list(tickers)))
+    )
+
+
+def store_prices(con: sqlite3.Connection, df: pd.DataFrame) -> int:
+    """Insert new (ticker, date) price rows and record their tickers, in one transaction."""
+    with transaction(con):
+        n = insert_rows(con, "prices", df, ["date", "ticker", "open", "high", "low", "close", "volume"])
+        touch_tickers(con, df["ticker"].unique().tolist())
+    return n
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import pandas as pd
+
+from config import settings
+from services.columns import write_columns, read_columns
+
+# Content-addressed feature blocks: FEATURE_STORE_DIR/<key>/ holds one columnar
+# folder per table plus block.json. The key hashes everything the block was computed
+# from (price data version, fundamentals, feature parameters, feature code), so a
+# block is never updated in place; new inputs give a new key. CURRENT names the block
+# that was last written to the dataset table.
+
+BLOCK = "block.json"
+CURRENT = "CURRENT"
+KEEP_BLOCKS = 3
+
+
+def prices_version(con: sqlite3.Connection) -> dict:
+    """Row counts and date range of the price tables; rows are only ever inserted."""
+    version = {}
+    for table in ("prices", "spy"):
+        n, first, last = con.execute(f"SELECT COUNT(*), MIN(date), MAX(date) FROM {table}").fetchone()
+        version[table] = [n, first, last]
+    return version
+
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """Hash of a frame's column names and values (not its index)."""
+    h = hashlib.sha256(json.dumps(list(map(str, df.columns))).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def code_version(*paths: str) -> str:
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def block_key(**inputs) -> str:
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()[:20]
+
+
+def load_block(key: str) -> dict[str, pd.DataFrame] | None:
+    """Tables of a stored block, memory-mapped, or None if the key was never computed."""
+    path = os.path.join(settings.FEATURE_STORE_DIR, key)
+    try:
+        with open(os.path.join(path, BLOCK)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    os.utime(path)  # recently used blocks survive pruning
+    return {name: read_columns(os.path.join(path, name), cols) for name, cols in meta["tables"].items()}
+
+
+def save_block(key: str, tables: dict[str, pd.DataFrame], inputs: dict) -> str:
+    """Write a block aside and rename it into place; older unused blocks are pruned."""
+    os.makedirs(settings.FEATURE_STORE_DIR, exist_ok=True)
+    path = os.path.join(settings.FEATURE_STORE_DIR, key)
+    tmp = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    meta = {
+        "key": key,
+        "inputs": inputs,
+        "created": time.time(),
+        "rows": {name: len(df) for name, df in tables.items()},
+        "tables": {name: write_columns(os.path.join(tmp, name), df) for name, df in tables.items()},
+    }
+    with open(os.path.join(tmp, BLOCK), "w") as f:
+        json.dump(meta, f, default=str)
+
+    if os.path.exists(path):
+        # same key, same content: another run got there first
+        shutil.rmtree(tmp, ignore_errors=True)
+    else:
+        os.rename(tmp, path)
+    _prune(keep={key, current_key()})
+    return path
+
+
+def _prune(keep: set):
+    root = settings.FEATURE_STORE_DIR
+    blocks = [e for e in os.listdir(root) if os.path.isfile(os.path.join(root, e, BLOCK))]
+    blocks.sort(key=lambda e: os.path.getmtime(os.path.join(root, e)), reverse=True)
+    for e in blocks[KEEP_BLOCKS:]:
+        if e not in keep:
+            shutil.rmtree(os.path.join(root, e), ignore_errors=True)
+
+
+def current_key() -> str | None:
+    try:
+        with open(os.path.join(settings.FEATURE_STORE_DIR, CURRENT)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def set_current(key: str | None):
+    os.makedirs(settings.FEATURE_STORE_DIR, exist_ok=True)
+    tmp = os.path.join(settings.FEATURE_STORE_DIR, CURRENT + ".tmp")
+    with open(tmp, "w") as f:
+        f.write(key or "")
+    os.replace(tmp, os.path.join(settings.FEATURE_STORE_DIR, CURRENT))
+
+
+def current_dataset(con: sqlite3.Connection = None) -> pd.DataFrame | None:
+    """
+    The dataset table of the CURRENT block. With a connection it is only returned
+    while the dataset table still has the block's rows (an incremental extend or a
+    different DB makes it stale).
+    """
+    key = current_key()
+    block = load_block(key) if key else None
+    if block is None:
+        return None
+    dataset = block["dataset"]
+    if con is not None:
+        n, last = con.execute("SELECT COUNT(*), MAX(date) FROM dataset").fetchone()
+        if n != len(dataset) or (n and str(pd.Timestamp(last)) != str(dataset["date"].max())):
+            return None
+    return dataset
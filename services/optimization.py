@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from typing import Any
 from skfolio.preprocessing import prices_to_returns
@@ -23,53 +24,58 @@ def normalize_weights(weights: dict, prices: dict | pd.Series, capital: float) -
         s['shares'] = shares
     return sorted(stocks, key=lambda x: x['weight'], reverse=True)
 
+FEATURE_EXCLUDE = {"ticker", "date", "quarter_id", "close_raw", "outperformed"}
+SELECT_THRESHOLD = 0.6
+
+
+def feature_matrix(dataset: pd.DataFrame) -> np.ndarray:
+    """Picker inputs: every dataset column except keys, prices and the label."""
+    feature_cols = [c for c in dataset.columns if c not in FEATURE_EXCLUDE]
+    return dataset[feature_cols].values
+
+
+def predict_matrix(X: np.ndarray, picker: Any) -> np.ndarray:
+    """Picker's probability of outperforming for every row of a feature matrix."""
+    if isinstance(picker, LinearSVC):
+        return picker._predict_proba_lr(X)[:, 1]
+    return picker.predict_proba(X)[:, 1]
+
+
+def predict_proba(dataset: pd.DataFrame, picker: Any) -> np.ndarray:
+    """Picker's probability of outperforming for every dataset row."""
+    return predict_matrix(feature_matrix(dataset), picker)
+
+
+def select_from_proba(dataset: pd.DataFrame, proba: np.ndarray) -> list[str]:
+    """Tickers whose mean probability over their latest quarter clears SELECT_THRESHOLD."""
+    quarter = dataset["quarter_id"]
+    latest = quarter.groupby(dataset["ticker"], observed=True).transform("max")
+    in_latest = (quarter == latest).to_numpy()
+    avg_pred = pd.Series(proba[in_latest]).groupby(dataset["ticker"].to_numpy()[in_latest]).mean()
+    return avg_pred.index[avg_pred > SELECT_THRESHOLD].tolist()
+
+
 def select_tickers(
     dataset: pd.DataFrame,
     picker: Any
 ) -> list[str]:
     """
     Given a dataset with feature columns and a trained picker,
-    return list of tickers with average probability > 0.5 in latest quarter.
+    return list of tickers with average probability > 0.6 in latest quarter.
     """
-    # identify feature cols
-    exclude = {"ticker", "date", "quarter_id", "close_raw", "outperformed"}
-    feature_cols = [c for c in dataset.columns if c not in exclude]
-
-    # predict probabilities
-    X = dataset[feature_cols].values
-    dataset = dataset.copy()
-    if isinstance(picker, LinearSVC):
-        dataset["pred_proba"] = picker._predict_proba_lr(X)[:, 1]
-    else:
-        dataset["pred_proba"] = picker.predict_proba(X)[:, 1]
-
-    # select latest quarter per ticker
-    latest_q = dataset.groupby("ticker")["quarter_id"].max().reset_index()
-    data_latest = pd.merge(dataset, latest_q, on=["ticker", "quarter_id"])
-    avg_pred = data_latest.groupby("ticker")["pred_proba"].mean().reset_index()
-
-    # tickers with prob > .5
-    selected = avg_pred.loc[avg_pred["pred_proba"] > 0.6, "ticker"].tolist()
-    return selected
+    return select_from_proba(dataset, predict_proba(dataset, picker))
 
 
 def optimize_portfolio(
-    prices: pd.DataFrame,
-    selected: list[str],
+    price_matrix: pd.DataFrame,
     risk_fn: Any
 ) -> tuple[dict, Any]:
     """
-    Given prices DataFrame and selected tickers, compute weights and portfolio object.
+    Given a wide date x ticker price matrix, compute weights and portfolio object.
     """
-    # pivot to wide
-    price_matrix = (
-        prices[prices["ticker"].isin(selected)]
-        .pivot(index="date", columns="ticker", values="price")
-        .sort_index()
-    )
     # compute returns
     ret = prices_to_returns(price_matrix)
 
     # optimize via risk_fn
     weights, ptf = risk_fn(ret)
-    return dict(zip(selected, weights)), ptf
\ No newline at end of file
+    return dict(zip(price_matrix.columns, weights)), ptf
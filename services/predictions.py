@@ -0,0 +1,120 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+from services.dataset import Snapshot
+from services.registry import ModelRegistry
+from services.optimization import SELECT_THRESHOLD, feature_matrix, predict_matrix, predict_proba
+
+
+class ScoringError(Exception):
+    """A picker failed to score; `name` is the picker."""
+
+    def __init__(self, name: str, error: Exception):
+        super().__init__(f"{name}: {error}")
+        self.name = name
+
+
+class PredictionCache:
+    """
+    Per-row pred_proba of each picker over the whole snapshot dataset, computed once
+    per (picker file, data version). A row's probability doesn't depend on the as-of
+    date, so selecting tickers for an end date only reads the cached scores of each
+    ticker's latest quarter (Snapshot.latest_quarter_rows).
+    Entries are keyed by the picker's registry file key, not the loaded model, so a
+    picker evicted from the ModelRegistry LRU is not kept alive here; they are
+    dropped when a newer snapshot is published or the picker file changes.
+    """
+    _entries: dict[str, tuple[int, tuple, np.ndarray]] = {}  # name -> (version, file key, proba)
+    _locks: dict[str, threading.Lock] = {}  # name -> lock held while scoring it
+    _guard = threading.Lock()
+
+    @classmethod
+    def _lock(cls, name: str) -> threading.Lock:
+        with cls._guard:
+            return cls._locks.setdefault(name, threading.Lock())
+
+    @classmethod
+    def _picker(cls, name: str):
+        picker = ModelRegistry.get_picker(name)
+        if picker is None:
+            raise KeyError(f"Unknown picker {name}")
+        return picker
+
+    @classmethod
+    def cached(cls, name: str, snapshot: Snapshot, file_key: tuple = None) -> np.ndarray | None:
+        file_key = file_key or ModelRegistry.file_key(name)
+        entry = cls._entries.get(name)
+        if entry is not None and entry[0] == snapshot.version and entry[1] == file_key:
+            return entry[2]
+        return None
+
+    @classmethod
+    def scores(cls, name: str, snapshot: Snapshot) -> np.ndarray:
+        # read before loading: if the file changes in between, the entry is only stale, never wrong
+        file_key = ModelRegistry.file_key(name)
+        proba = cls.cached(name, snapshot, file_key)
+        if proba is not None:
+            return proba
+        with cls._lock(name):
+            proba = cls.cached(name, snapshot, file_key)
+            if proba is not None:
+                return proba
+            proba = predict_proba(snapshot.dataset(), cls._picker(name))
+            proba.flags.writeable = False
+            # never replace scores for a newer version with older ones
+            entry = cls._entries.get(name)
+            if entry is None or entry[0] <= snapshot.version:
+                cls._entries[name] = (snapshot.version, file_key, proba)
+            return proba
+
+    @classmethod
+    def latest_scores(cls, names: list[str], snapshot: Snapshot, end, workers: int = 1) -> dict[str, pd.Series]:
+        """
+        Mean probability over each ticker's latest quarter as of `end`, per picker.
+        Pickers without cached scores share one feature matrix of those rows and
+        are scored in a pool of `workers` threads. A picker that fails to score
+        raises ScoringError naming it.
+        """
+        rows, _ = snapshot.latest_quarter_rows(end)
+        if not len(rows):
+            return {name: pd.Series(dtype=float) for name in names}
+        dataset = snapshot.dataset()
+        tickers = dataset["ticker"].to_numpy()[rows]
+        cached = {name: cls.cached(name, snapshot) for name in names}
+        X = feature_matrix(dataset.iloc[rows]) if any(p is None for p in cached.values()) else None
+
+        def score(name):
+            try:
+                proba = cached[name][rows] if cached[name] is not None else predict_matrix(X, cls._picker(name))
+            except Exception as e:
+                raise ScoringError(name, e) from e
+            return pd.Series(proba).groupby(tickers).mean()
+
+        if workers <= 1 or len(names) <= 1:
+            return {name: score(name) for name in names}
+        with ThreadPoolExecutor(max_workers=min(workers, len(names))) as pool:
+            return dict(zip(names, pool.map(score, names)))
+
+    @classmethod
+    def select(cls, name: str, snapshot: Snapshot, end) -> list[str]:
+        """
+        select_tickers(snapshot.dataset_until(end), picker), reading only each ticker's
+        latest-quarter rows. Before the snapshot is warmed, only those rows are scored.
+        """
+        avg_pred = cls.latest_scores([name], snapshot, end)[name]
+        return avg_pred.index[avg_pred > SELECT_THRESHOLD].tolist()
+
+    @classmethod
+    def warm(cls, snapshot: Snapshot):
+        """Score every registered picker on a newly published snapshot."""
+        for name in ModelRegistry.list_pickers():
+            try:
+                cls.scores(name, snapshot)
+            except Exception as e:
+                print(f"PredictionCache: warming {name} failed: {e}")
+        with cls._guard:
+            for name in [n for n, e in cls._entries.items() if e[0] < snapshot.version]:
+                del cls._entries[name]
+        print(f"PredictionCache: warmed {len(cls._entries)} pickers for data version {snapshot.version}")
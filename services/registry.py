@@ -1,8 +1,12 @@
 import os
+import json
+import threading
 import joblib
+from collections import OrderedDict
 from typing import List, Callable
 
 from config import settings
+from model.compiled import CompiledPicker, compile_picker
 from model.opt import (
     equal_weighted_portfolio,
     min_variance_portfolio,
@@ -10,9 +14,26 @@ from model.opt import (
     nco_portfolio,
 )
 
+# walk-forward scores of the pickers, written next to them by model/train.py
+METRICS = "metrics.json"
+
 
 class ModelRegistry:
+    """
+    Picker files found in the pickers directory, and an LRU of the loaded models.
+    Cached models are keyed by file mtime and size, so a retrained picker is reloaded
+    on its next use; the directory is rescanned whenever its mtime changes. The LRU
+    is bounded by PICKER_CACHE_MB, using file sizes as the memory estimate.
+    With PICKER_COMPILE, random forest and linear pickers are reduced to flat arrays
+    (model.compiled) when loaded, and those are cached and served instead.
+    """
     _pickers: dict[str, str] = {}
+    _dir: str = None
+    _dir_mtime: int = None
+    _cache: OrderedDict = OrderedDict()  # name -> (file key, model, size)
+    _cache_bytes: int = 0
+    _stats = {"hits": 0, "misses": 0, "reloads": 0, "evictions": 0}
+    _lock = threading.Lock()
     _risk_map: dict[str, Callable] = {
         "mean_variance": min_variance_portfolio,
         "ledoit_wolf": min_variance_ledoitwolf,
@@ -22,21 +43,122 @@ class ModelRegistry:
 
     @classmethod
     def scan(cls, dir_path: str):
+        pickers = {}
+        mtime = os.stat(dir_path).st_mtime_ns
         for fn in os.listdir(dir_path):
             if fn.endswith(".pkl"):
                 name = fn[:-4]
-                cls._pickers[name] = os.path.join(dir_path, fn)
+                pickers[name] = os.path.join(dir_path, fn)
+        with cls._lock:
+            cls._pickers = pickers
+            cls._dir, cls._dir_mtime = dir_path, mtime
+            for name in [n for n in cls._cache if n not in pickers]:
+                cls._drop(name)
+
+    @classmethod
+    def _rescan(cls):
+        if cls._dir is None:
+            return
+        try:
+            changed = os.stat(cls._dir).st_mtime_ns != cls._dir_mtime
+        except OSError:
+            return
+        if changed:
+            cls.scan(cls._dir)
 
     @classmethod
     def list_pickers(cls) -> List[str]:
+        cls._rescan()
         return list(cls._pickers.keys())
 
     @classmethod
-    def get_picker(cls, name: str):
+    def file_key(cls, name: str) -> tuple[str, int, int] | None:
+        """(path, mtime, size) of a picker's file: changes whenever the picker is retrained."""
+        cls._rescan()
         path = cls._pickers.get(name)
         if not path:
             return None
-        return joblib.load(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return path, st.st_mtime_ns, st.st_size
+
+    @classmethod
+    def get_picker(cls, name: str):
+        file_key = cls.file_key(name)
+        if file_key is None:
+            return None
+        path, mtime, size = file_key
+        key = (mtime, size)
+
+        with cls._lock:
+            entry = cls._cache.get(name)
+            if entry is not None and entry[0] == key:
+                cls._cache.move_to_end(name)
+                cls._stats["hits"] += 1
+                return entry[1]
+            cls._stats["misses"] += 1
+            if entry is not None:
+                cls._stats["reloads"] += 1
+                cls._drop(name)
+
+        # load outside the lock so one slow load doesn't block hits on other pickers
+        model = joblib.load(path, mmap_mode=settings.PICKER_MMAP_MODE or None)
+        if settings.PICKER_COMPILE:
+            model = cls.export(model)
+
+        with cls._lock:
+            if name in cls._cache:
+                cls._drop(name)
+            cls._cache[name] = (key, model, size)
+            cls._cache_bytes += size
+            budget = settings.PICKER_CACHE_MB * 1024 ** 2
+            # evict least recently used, always keeping the model just loaded
+            while cls._cache_bytes > budget and len(cls._cache) > 1:
+                cls._drop(next(iter(cls._cache)))
+                cls._stats["evictions"] += 1
+        return model
+
+    @classmethod
+    def export(cls, picker):
+        """CompiledPicker for a fitted forest or linear picker, or the picker itself if unsupported."""
+        try:
+            return compile_picker(picker) or picker
+        except Exception as e:
+            print(f"ModelRegistry: compiling {type(picker).__name__} failed, serving it as is: {e}")
+            return picker
+
+    @classmethod
+    def _drop(cls, name: str):
+        _, _, size = cls._cache.pop(name)
+        cls._cache_bytes -= size
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        with cls._lock:
+            return {
+                **cls._stats,
+                "cached": list(cls._cache),
+                "compiled": [n for n, entry in cls._cache.items() if isinstance(entry[1], CompiledPicker)],
+                "cached_mb": round(cls._cache_bytes / 1024 ** 2, 1),
+                "budget_mb": settings.PICKER_CACHE_MB,
+            }
+
+    @classmethod
+    def metrics(cls, name: str = None) -> dict | None:
+        """Training manifest of the pickers directory, or one picker's entry in it."""
+        cls._rescan()
+        if cls._dir is None:
+            return None
+        try:
+            with open(os.path.join(cls._dir, METRICS)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if name is None:
+            return manifest
+        return manifest.get("models", {}).get(name)
 
     @classmethod
     def list_risk_models(cls) -> List[str]:
@@ -44,4 +166,4 @@ class ModelRegistry:
 
     @classmethod
     def get_risk_fn(cls, name: str):
-        return cls._risk_map.get(name)
\ No newline at end of file
+        return cls._risk_map.get(name)
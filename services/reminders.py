@@ -1,4 +1,5 @@
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.jobstores.mongodb import MongoDBJobStore
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
@@ -22,6 +23,8 @@ jobstore = MongoDBJobStore(
 )
 scheduler = BackgroundScheduler(timezone=pytz.timezone("America/New_York"))
 scheduler.add_jobstore(jobstore)
+# jobs of this process only, such as the reminder sync, never written to Mongo
+scheduler.add_jobstore(MemoryJobStore(), alias="local")
 
 async def send_reminder(reminder_id: str):
     # TODO: implement notification logic (email/Telegram)
@@ -32,18 +35,20 @@ def init_scheduler():
     """
     Start scheduler and register existing reminders.
     Active jobs are resumed; inactive are paused.
+    Only the scheduling process calls this: with several uvicorn workers that is
+    the parent, and workers just write reminder documents, which the scheduler
+    picks up every REMINDER_SYNC_SECONDS (sync_reminders).
     """
     print("Loading Reminders...")
     scheduler.start()
-    for doc in reminders_col.find():
-        job_id = doc["job_id"]
-        try:
-            if doc.get("active"):
-                scheduler.resume_job(job_id)
-            else:
-                scheduler.pause_job(job_id)
-        except Exception:
-            continue
+    sync_reminders()
+    scheduler.add_job(
+        func=sync_reminders,
+        trigger=IntervalTrigger(seconds=settings.REMINDER_SYNC_SECONDS),
+        id="sync_reminders",
+        jobstore="local",
+        replace_existing=True,
+    )
 
     update_doc = updates_col.find_one({"name": "prices"})
     if update_doc is None:
@@ -64,48 +69,75 @@ def init_scheduler():
         })
 
 
+def _trigger(doc: dict):
+    typ = doc["type"]
+    if typ == "daily":
+        return CronTrigger(day_of_week="mon-thu", hour=17, minute=0, timezone="America/New_York")
+    if typ == "weekly":
+        return CronTrigger(day_of_week="fri", hour=17, minute=0, timezone="America/New_York")
+    # Mongo hands datetimes back as naive UTC
+    start = doc.get("start_date") or doc["created_at"]
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    return IntervalTrigger(weeks=13, start_date=start.astimezone(pytz.timezone("America/New_York")))
+
+
+def _sync_job(doc: dict, job=None):
+    """Make the reminder's job (None: not scheduled yet) exist and match its document's active flag."""
+    job_id = doc["job_id"]
+    if job is None:
+        job = scheduler.add_job(
+            func=send_reminder,
+            trigger=_trigger(doc),
+            id=job_id,
+            args=[doc["_id"]],
+            replace_existing=True
+        )
+        if not doc.get("active"):
+            scheduler.pause_job(job_id)
+    elif doc.get("active") and job.next_run_time is None:
+        scheduler.resume_job(job_id)
+    elif not doc.get("active") and job.next_run_time is not None:
+        scheduler.pause_job(job_id)
+
+
+def sync_reminders():
+    """Bring the job store in line with the reminder documents; run by the scheduling process."""
+    jobs = {job.id: job for job in scheduler.get_jobs(jobstore="default") if job.func is send_reminder}
+    for doc in reminders_col.find():
+        try:
+            _sync_job(doc, jobs.pop(doc["job_id"], None))
+        except Exception as e:
+            print(f"Reminders: syncing {doc['_id']} failed: {e}")
+    # reminders whose documents are gone
+    for job in jobs.values():
+        job.remove()
+
+
 def create_reminders_for_portfolio(portfolio_id: str, created_at: datetime):
     """
-    Batch-create daily, weekly, and quarterly reminders for a portfolio.
-    Jobs are scheduled then immediately paused (active=False).
+    Batch-create daily, weekly, and quarterly reminders for a portfolio, inactive.
+    Only the documents are written here; the scheduling process adds their jobs,
+    right away when that is this process.
     Returns list of inserted reminder documents.
     """
-    triggers = {
-        "daily": CronTrigger(
-            day_of_week="mon-thu", hour=17, minute=0,
-            timezone="America/New_York"
-        ),
-        "weekly": CronTrigger(
-            day_of_week="fri", hour=17, minute=0,
-            timezone="America/New_York"
-        ),
-        "quarterly": IntervalTrigger(
-            weeks=13,
-            start_date=created_at.astimezone(pytz.timezone("America/New_York"))
-        ),
-    }
     now = datetime.now(timezone.utc)
     docs = []
-    for typ, trigger in triggers.items():
+    for typ in ("daily", "weekly", "quarterly"):
         rem_id = uuid.uuid4().hex
-        job = scheduler.add_job(
-            func=send_reminder,
-            trigger=trigger,
-            id=rem_id,
-            args=[rem_id],
-            replace_existing=True
-        )
-        scheduler.pause_job(rem_id)
         doc = {
             "_id": rem_id,
             "portfolio_id": portfolio_id,
             "type": typ,
-            "job_id": job.id,
+            "job_id": rem_id,
             "active": False,
+            "start_date": created_at.astimezone(timezone.utc),
             "created_at": now,
             "updated_at": now,
         }
         reminders_col.insert_one(doc)
+        if scheduler.running:
+            _sync_job(doc)
         docs.append(doc)
     return docs
 
@@ -113,22 +145,19 @@ def create_reminders_for_portfolio(portfolio_id: str, created_at: datetime):
 def toggle_reminder(reminder_id: str, active: bool) -> dict:
     """
     Pause or resume an existing reminder.
-    Updates both APScheduler and the Mongo document.
+    Updates the Mongo document, and the job if this process runs the scheduler;
+    otherwise the scheduling process applies it on its next sync.
     """
-    doc = reminders_col.find_one({"_id": reminder_id})
-    if not doc:
-        raise ValueError("Reminder not found")
-    job_id = doc["job_id"]
-    if active:
-        scheduler.resume_job(job_id)
-    else:
-        scheduler.pause_job(job_id)
     new_time = datetime.now(timezone.utc)
     updated = reminders_col.find_one_and_update(
         {"_id": reminder_id},
         {"$set": {"active": active, "updated_at": new_time}},
         return_document=True
     )
+    if not updated:
+        raise ValueError("Reminder not found")
+    if scheduler.running:
+        _sync_job(updated, scheduler.get_job(updated["job_id"]))
     return updated
 
 
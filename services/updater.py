@@ -1,15 +1,52 @@
 import sqlite3
+import threading
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from datetime import datetime, timedelta
 
 from config import settings
-from model.price import download_prices
-from model.features import resample_weekly, generate_technicals, normalize_features
+from model.price import download_prices, checkpoint_end, clear_checkpoints
+from model import features, rolling
+from model.features import (
+    resample_weekly,
+    generate_technicals,
+    scale_features,
+    feature_moments,
+    merge_moments,
+    remove_moments,
+    standardize_features,
+    unstandardize_features,
+    asof_join,
+    TECHNICAL_COLUMNS,
+)
+from services.dataset import export_snapshot, PricesCache
+from services.db import connect, transaction, insert_rows, write_table, touch_tickers
+from services.feature_store import (
+    prices_version,
+    frame_digest,
+    code_version,
+    block_key,
+    load_block,
+    save_block,
+    set_current,
+)
 
 DB = settings.DB_PATH  # e.g. "data/data.db"
 
+PRICE_COLUMNS = ["date", "ticker", "open", "high", "low", "close", "volume"]
+SPY_COLUMNS = ["date", "open", "high", "low", "close", "volume"]
+# ma_pr_52w has the longest window; the extra history lets RSI's recursive smoothing settle
+TAIL_WEEKS = 156
+SHARDS_PER_WORKER = 4
+# how dates are stored as text in the price and dataset tables (see insert_rows)
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# part of the feature block key; bump when the feature definitions change outside the code
+FEATURE_PARAMS = {"resample": "W-FRI", "normalization": "ticker_zscore"}
+
 def update_prices():
-    con = sqlite3.connect(DB)
+    con = connect(DB)
     # 1) get last updated datetime for 'prices'
     last = pd.read_sql(
         "SELECT datetime FROM last_updated WHERE data='prices'", con,
@@ -19,84 +56,298 @@ def update_prices():
     print('Updating prices...')
 
     start = (last + timedelta(days=1)).date().isoformat()
+    # end is exclusive and pinned by the first attempt, so a resumed run fetches the same range
+    end = checkpoint_end(settings.DOWNLOAD_CHECKPOINT_DIR, start)
 
-    # 2) load existing tables
-    prices_old = pd.read_sql("SELECT * FROM prices", con, parse_dates=["date"])
-    spy_old    = pd.read_sql("SELECT * FROM spy", con, parse_dates=["date"])
-
-    # 3) download new data
-    tickers = prices_old["ticker"].unique().tolist()
-    new_prices = download_prices(tickers, start=start)
-    new_spy = download_prices(["SPY"], start=start)
+    # 2) download new data, resuming from checkpointed chunks of a failed run
+    tickers = [t for (t,) in con.execute("SELECT DISTINCT ticker FROM prices")]
+    download = dict(
+        start=start,
+        end=end,
+        chunk_size=settings.DOWNLOAD_CHUNK_SIZE,
+        workers=settings.DOWNLOAD_WORKERS,
+        checkpoint_dir=settings.DOWNLOAD_CHECKPOINT_DIR,
+    )
+    new_prices = download_prices(tickers, **download)
+    new_spy = download_prices(["SPY"], **download)
 
-    # 4) concat, dedupe, sort, reset
-    prices = pd.concat([prices_old, new_prices], ignore_index=True)
-    prices = prices.drop_duplicates(subset=["ticker","date"])
-    prices = prices.sort_values(["ticker","date"]).reset_index(drop=True)
+    # 3) append only the new (ticker, date) rows and bump last_updated in one transaction
+    with transaction(con):
+        n_prices = insert_rows(con, "prices", new_prices, PRICE_COLUMNS)
+        n_spy = insert_rows(con, "spy", new_spy, SPY_COLUMNS)
+        touch_tickers(con, new_prices["ticker"].unique().tolist())
+        # the last day the download covered; the next update starts the day after
+        covered = (pd.Timestamp(end) - timedelta(days=1)).isoformat()
+        con.execute(
+            "UPDATE last_updated SET datetime = ? WHERE data = 'prices'",
+            (covered,)
+        )
+    con.close()
+    clear_checkpoints(settings.DOWNLOAD_CHECKPOINT_DIR)
+    print(f'Inserted {n_prices} price rows, {n_spy} SPY rows')
 
-    spy = pd.concat([spy_old, new_spy], ignore_index=True)
-    spy = spy.drop_duplicates(subset=["date"])
-    spy = spy.sort_values("date").reset_index(drop=True)
+    return 1
 
-    # 5) replace tables
-    prices.to_sql("prices", con, if_exists="replace", index=False)
-    spy[['date','open','high','low','close','volume']].to_sql(
-        "spy", con, if_exists="replace", index=False
+def moments_table(moments: pd.DataFrame) -> pd.DataFrame:
+    """feature_moments() as long (ticker, feature, n, mean, m2) rows for SQLite."""
+    table = (
+        moments["n"].rename_axis(index="ticker", columns=None).reset_index()
+        .melt(id_vars="ticker", var_name="feature", value_name="n")
     )
+    table["mean"] = moments["mean"].to_numpy().ravel(order="F")
+    table["m2"] = moments["m2"].to_numpy().ravel(order="F")
+    return table
 
-    # 6) bump last_updated
-    now = datetime.now().isoformat()
-    con.execute(
-        "UPDATE last_updated SET datetime = ? WHERE data = 'prices'",
-        (now,)
-    )
-    con.commit()
-    con.close()
+def read_moments(con: sqlite3.Connection) -> pd.DataFrame | None:
+    exists = con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='feature_moments'").fetchone()
+    if not exists:
+        return None
+    table = pd.read_sql("SELECT * FROM feature_moments", con)
+    return table.pivot(index="ticker", columns="feature", values=["n", "mean", "m2"])
 
-    return 1
 
-def rebuild_dataset():
-    print('Rebuilding dataset...')
-    con = sqlite3.connect(DB)
-    prices = pd.read_sql("SELECT * FROM prices", con, parse_dates=["date"])
-    prices_w = resample_weekly(prices[["ticker","date","close","volume"]])
-    spy = pd.read_sql("SELECT * FROM spy", con, parse_dates=["date"])
-    spy = spy.assign(ticker="SPY")
-    spy_w = resample_weekly(spy[["ticker","date","close","volume"]])
+def fundamentals_rows(ds: pd.DataFrame) -> pd.DataFrame:
+    """
+    The quarterly fundamentals the dataset is joined from: one row per ticker and
+    quarter, without the weekly technicals and dates a rebuild rewrites around them.
+    """
+    fund = ds.drop(columns=["date","since_quarter_start","close","volume"] + TECHNICAL_COLUMNS, errors="ignore")
+    # rows before a ticker's first quarter come back from the as-of join without one
+    fund = fund.dropna(subset=["quarter_id"]).astype({"quarter_id": "int64"})
+    return fund.drop_duplicates(["ticker","quarter_id"]).sort_values(["ticker","quarter_id"]).reset_index(drop=True)
+
 
-    tech = generate_technicals(prices_w, benchmark_df=spy_w[["date","close"]])
-    tech = normalize_features(tech)
+def rebuild_dataset(incremental: bool = False):
+    """
+    Recompute technical features and re-attach fundamentals from the current dataset.
+    The result is kept in the feature store, and a full rebuild whose inputs are
+    unchanged writes the stored block back instead of recomputing it.
+    With incremental=True only weeks past each ticker's last dataset row are
+    computed and appended (see extend_dataset), until DATASET_MAX_EXTEND_WEEKS have
+    been appended since the last full rebuild.
+    """
+    if incremental:
+        con = connect(DB)
+        moments = read_moments(con)
+        weeks = extended_weeks(con)
+        con.close()
+        if moments is None:
+            print('No stored feature moments, running a full rebuild')
+        elif weeks >= settings.DATASET_MAX_EXTEND_WEEKS:
+            print(f'{weeks:.0f} weeks appended since the last full rebuild, running a full rebuild')
+        else:
+            extend_dataset(moments)
+            publish_snapshot()
+            return
 
+    print('Rebuilding dataset...')
+    con = connect(DB)
     ds = pd.read_sql("SELECT * FROM dataset", con, parse_dates=["date"])
-    tech_cols = [c for c in tech.columns if c not in ("ticker","date")]
-    fund = ds.drop(columns=tech_cols, errors="ignore")
-    print(fund[fund['ticker'] == 'AAPL']['outperformed'].values)
-
-    frames = []
-    for tkr, t_df in tech.groupby("ticker"):
-        f_df = fund[fund["ticker"]==tkr].sort_values("date")
-        merged = pd.merge_asof(
-            t_df.sort_values("date"),
-            f_df,
-            on="date",
-            by="ticker",
-            direction="backward"
+
+    # the block is keyed by everything it is computed from; an unchanged key reuses it
+    inputs = {
+        "prices": prices_version(con),
+        "fundamentals": frame_digest(fundamentals_rows(ds)),
+        "params": {**FEATURE_PARAMS, "technicals": settings.TECHNICALS_ENGINE},
+        "code": code_version(features.__file__, rolling.__file__, __file__),
+    }
+    key = block_key(**inputs)
+    block = load_block(key)
+    if block is None:
+        prices = pd.read_sql("SELECT * FROM prices", con, parse_dates=["date"])
+        prices_w = resample_weekly(prices[["ticker","date","close","volume"]])
+        spy = pd.read_sql("SELECT * FROM spy", con, parse_dates=["date"])
+        spy = spy.assign(ticker="SPY")
+        spy_w = resample_weekly(spy[["ticker","date","close","volume"]])
+
+        new_ds, moments = build_dataset(prices_w, spy_w[["date","close"]], ds, settings.DATASET_WORKERS)
+        block = {"dataset": new_ds, "moments": moments_table(moments)}
+        save_block(key, block, inputs)
+    else:
+        print(f'Reusing feature block {key}')
+
+    # 5) overwrite, keeping the normalisation moments for incremental rebuilds
+    write_table(con, "dataset", block["dataset"], key=["ticker","date"])
+    write_table(con, "feature_moments", block["moments"], key=["ticker","feature"])
+    # the last week a full rebuild covered; extended_weeks counts from here
+    with transaction(con):
+        con.execute("DELETE FROM last_updated WHERE data = 'dataset'")
+        con.execute(
+            "INSERT INTO last_updated VALUES ('dataset', ?)",
+            (str(block["dataset"]["date"].max()),)
         )
-        frames.append(merged)
+    con.close()
+    set_current(key)
+
+    publish_snapshot()
+
+def build_shard(prices_w: pd.DataFrame, spy_w: pd.DataFrame, ds: pd.DataFrame):
+    """
+    Technicals, normalisation and the fundamentals as-of join for a set of tickers.
+    Every step is per ticker, so shards are independent. Returns the dataset rows as
+    {column: array} (cheap to pickle back from a worker) and the feature moments.
+    """
+    tech = generate_technicals(prices_w, benchmark_df=spy_w, engine=settings.TECHNICALS_ENGINE)
+    tech = scale_features(tech)
+    moments = feature_moments(tech)
+    tech = standardize_features(tech, moments)
 
-    new_ds = pd.concat(frames, ignore_index=True)
-    new_ds = new_ds.sort_values(["ticker","date"]).reset_index(drop=True)
+    tech_cols = [c for c in tech.columns if c not in ("ticker","date")]
+    fund = ds.drop(columns=tech_cols, errors="ignore")
 
     no_fill = {"ticker","date","quarter_id","since_quarter_start","outperformed"}
     to_ffill = [c for c in fund.columns if c not in no_fill]
-    new_ds[to_ffill] = new_ds.groupby("ticker")[to_ffill].ffill()
+    new_ds = asof_join(tech, fund, ffill=to_ffill)
 
-    # 5) overwrite
-    new_ds.to_sql("dataset", con, if_exists="replace", index=False)
+    return {c: new_ds[c].to_numpy() for c in new_ds.columns}, moments
+
+def build_dataset(prices_w: pd.DataFrame, spy_w: pd.DataFrame, ds: pd.DataFrame, workers: int = 1):
+    """
+    Run build_shard over contiguous, sorted ticker shards, in a process pool when
+    workers > 1. Shards are reassembled in ticker order, so the output does not
+    depend on the worker count.
+    """
+    tickers = np.sort(prices_w["ticker"].unique())
+    n_shards = 1 if workers <= 1 else min(len(tickers), workers * SHARDS_PER_WORKER)
+    shard_of = pd.Series(np.arange(len(tickers)) * n_shards // max(len(tickers), 1), index=tickers)
+
+    price_shards = dict(list(prices_w.groupby(prices_w["ticker"].map(shard_of))))
+    ds_shards = dict(list(ds.groupby(ds["ticker"].map(shard_of))))
+    args = [(price_shards[i], spy_w, ds_shards.get(i, ds.iloc[:0])) for i in sorted(price_shards)]
+
+    if n_shards == 1:
+        results = [build_shard(*a) for a in args]
+    else:
+        print(f"Building dataset in {n_shards} shards on {workers} processes")
+        # spawn: the API process has live threads (snapshot watcher, scheduler)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+            results = list(pool.map(build_shard, *zip(*args)))
+
+    new_ds = pd.concat([pd.DataFrame(arrays) for arrays, _ in results], ignore_index=True)
+    moments = pd.concat([m for _, m in results])
+    return new_ds, moments
+
+def extended_weeks(con: sqlite3.Connection) -> float:
+    """Weeks of dataset rows appended since the last full rebuild (inf if none is recorded)."""
+    row = con.execute("SELECT datetime FROM last_updated WHERE data = 'dataset'").fetchone()
+    last = con.execute("SELECT MAX(date) FROM dataset").fetchone()[0]
+    if row is None or last is None:
+        return float("inf")
+    return (pd.Timestamp(last) - pd.Timestamp(row[0])) / pd.Timedelta(weeks=1)
+
+def extend_dataset(moments: pd.DataFrame) -> int:
+    """
+    Append weeks past each ticker's last dataset row, and replace that row, which may
+    have been resampled from a partial week. Technicals are recomputed over each
+    ticker's trailing TAIL_WEEKS only, the stored moments are updated with the
+    recomputed rows and used to z-score them, and fundamentals are carried from each
+    ticker's last row, which is what the as-of join of a full rebuild gives them.
+    Tickers with prices but no dataset rows yet are built over their whole history, as
+    a full rebuild would. Earlier rows keep the moments they were z-scored with, so
+    the table drifts from a full rebuild as rows are appended; rebuild_dataset bounds
+    that with DATASET_MAX_EXTEND_WEEKS.
+    """
+    print('Extending dataset...')
+    con = connect(DB)
+    last = pd.read_sql(
+        "SELECT ticker, MAX(date) AS last_date FROM dataset GROUP BY ticker", con,
+        parse_dates=["last_date"]
+    )
+    # per ticker, start right after a Friday so the first resampled week is complete
+    since = last["last_date"] - pd.Timedelta(weeks=TAIL_WEEKS) - pd.offsets.Week(weekday=4)
+    with transaction(con):
+        con.execute("CREATE TEMP TABLE extend_since (ticker TEXT PRIMARY KEY, since TIMESTAMP)")
+        con.executemany("INSERT INTO extend_since VALUES (?, ?)", zip(last["ticker"], since.dt.strftime(DATE_FORMAT)))
+    prices = pd.read_sql(
+        """
+        SELECT p.ticker, p.date, p.close, p.volume FROM prices p
+        JOIN extend_since s ON p.ticker = s.ticker AND p.date > s.since
+        """,
+        con, parse_dates=["date"]
+    )
+    added = pd.read_sql(
+        """
+        SELECT ticker, date, close, volume FROM prices
+        WHERE ticker NOT IN (SELECT ticker FROM extend_since)
+        """,
+        con, parse_dates=["date"]
+    )
+    con.execute("DROP TABLE extend_since")
+    # new tickers need the benchmark over their whole history
+    spy_since = str(since.min()) if added.empty else ""
+    spy = pd.read_sql(
+        "SELECT date, close, volume FROM spy WHERE date > ?", con,
+        params=(spy_since,), parse_dates=["date"]
+    )
+    spy_w = resample_weekly(spy.assign(ticker="SPY"))[["date","close"]]
+
+    tech = generate_technicals(resample_weekly(prices), benchmark_df=spy_w, engine=settings.TECHNICALS_ENGINE)
+    tech = scale_features(tech).merge(last, on="ticker", how="left")
+    # each ticker's last row is recomputed too: prices may have ended mid-week when it was built
+    new = tech[tech["date"] >= tech["last_date"]].drop(columns="last_date")
+    if new.empty and added.empty:
+        con.close()
+        return 0
+
+    stored = pd.read_sql(
+        """
+        SELECT d.* FROM dataset d
+        JOIN (SELECT ticker, MAX(date) AS date FROM dataset GROUP BY ticker) m
+          ON d.ticker = m.ticker AND d.date = m.date
+        """,
+        con, parse_dates=["date"]
+    )
+    # the replaced rows leave the moments (they were z-scored with the stored ones)
+    tech_cols = [c for c in new.columns if c not in ("ticker","date")]
+    replaced = stored.merge(new[["ticker","date"]], on=["ticker","date"])
+    replaced_moments = feature_moments(unstandardize_features(replaced[new.columns], moments))
+    moments = remove_moments(moments, replaced_moments)
+    moments = merge_moments(moments, feature_moments(new))
+    new = standardize_features(new, moments)
+
+    # fundamentals carried from the last stored row, read before it is replaced
+    fund = stored.drop(columns=tech_cols + ["date"], errors="ignore")
+    new = new.merge(fund, on="ticker", how="left")
+
+    if len(added):
+        print(f'Building {added["ticker"].nunique()} new tickers')
+        no_rows = pd.read_sql("SELECT * FROM dataset LIMIT 0", con, parse_dates=["date"])
+        added_ds, added_moments = build_dataset(resample_weekly(added), spy_w, no_rows, settings.DATASET_WORKERS)
+        new = pd.concat([new, added_ds], ignore_index=True)
+        moments = merge_moments(moments, added_moments)
+
+    columns = [c[1] for c in con.execute("PRAGMA table_info(dataset)")]
+    with transaction(con):
+        con.executemany(
+            "DELETE FROM dataset WHERE ticker = ? AND date = ?",
+            zip(replaced["ticker"], replaced["date"].dt.strftime(DATE_FORMAT))
+        )
+        n_rows = insert_rows(con, "dataset", new.reindex(columns=columns), columns) - len(replaced)
+        con.execute("DELETE FROM feature_moments")
+        table = moments_table(moments)
+        insert_rows(con, "feature_moments", table, list(table.columns))
     con.close()
+    print(f'Appended {n_rows} dataset rows, recomputed {len(replaced)}')
+    return n_rows
+
+def publish_snapshot():
+    # write the new on-disk snapshot and swap it into a running API process
+    export_snapshot()
+    PricesCache.reload()
+
+# the startup update and the 16:30 job share the download checkpoints; one run at a time
+_update_lock = threading.Lock()
+
 
 def run_full_update():
-    update_prices()
+    if not _update_lock.acquire(blocking=False):
+        print("Update already running, skipping")
+        return
+    try:
+        if update_prices():
+            publish_snapshot()
+    finally:
+        _update_lock.release()
 
 
 if __name__ == "__main__":